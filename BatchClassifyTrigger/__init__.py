@@ -0,0 +1,37 @@
+import logging
+import json
+
+import azure.functions as func
+from ..shared_code.impersonation_monitor import ImpersonationMonitor
+
+#Body is a JSON list of {"accountId": int, "accountType": int, "newStatus": str} objects
+def main(req: func.HttpRequest) -> func.HttpResponse:
+
+    try:
+        body = req.get_json()
+    except ValueError:
+        logging.warning(f"BatchClassification Trigger - Invalid Request Received - Body is not JSON")
+        return func.HttpResponse(status_code = 400, body = "Invalid Request - Body Must be a JSON List of Classifications")
+    if not isinstance(body, list) or not body:
+        logging.warning(f"BatchClassification Trigger - Invalid Request Received - Body is not a Non-Empty List")
+        return func.HttpResponse(status_code = 400, body = "Invalid Request - Body Must be a JSON List of Classifications")
+
+    items = []
+    for index, item in enumerate(body):
+        try:
+            items.append((int(item["accountId"]), int(item["accountType"]), str(item["newStatus"])))
+        except (KeyError, TypeError, ValueError):
+            logging.warning(f"BatchClassification Trigger - Invalid Request Received - Malformed Item - Index: {index}")
+            return func.HttpResponse(status_code = 400, body = f"Invalid Request - Item {index} Must Have Integer accountId and accountType and a String newStatus")
+
+    try:
+        im = ImpersonationMonitor()
+    except Exception as e:
+        logging.error(f"BatchClassification Trigger - Failed to Initialize Impersonation Monitor - Msg: {e.args}")
+        return func.HttpResponse(status_code = 503, body = "Service Unavailable - Couldn't Connect to the Database, Try Again Later")
+    logging.info(f"BatchClassification Trigger - Request Received - Total Items: {len(items)}")
+    try:
+        results = im.classify_batch(items)
+    finally:
+        im.close()
+    return func.HttpResponse(status_code = 200, body = json.dumps(results), mimetype = "application/json")
@@ -38,9 +38,16 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             logging.warning(f"UpdateAccountClassification Trigger - Invalid Request Received - newStatus Param not String")
             return func.HttpResponse(status_code = 400, body = "Invalid Request - Required Parameter newStatus Must be a String!")
 
-    im = ImpersonationMonitor()
+    try:
+        im = ImpersonationMonitor()
+    except Exception as e:
+        logging.error(f"UpdateAccountClassification Trigger - Failed to Initialize Impersonation Monitor - Msg: {e.args}")
+        return func.HttpResponse(status_code = 503, body = "Service Unavailable - Couldn't Connect to the Database, Try Again Later")
     logging.info(f"UpdateAccountClassification Trigger - Request Received - Account ID: {account_id} - New Status: {new_status}")
-    success = im.classify(account_id, account_type, new_status)
+    try:
+        success = im.classify(account_id, account_type, new_status)
+    finally:
+        im.close()
     if not success:
         return func.HttpResponse(status_code = 400, body = "Invalid Request - Failed to Update Account - Unknown Reason")
 
@@ -13,7 +13,10 @@ def main(mytimer: func.TimerRequest) -> None:
     logging.info(f'TimerTrigger - Timer is Past Due - Beginning Account Search  - Start Time: {utc_timestamp}')
 
     im = ImpersonationMonitor()
-    im.run()
+    try:
+        im.run()
+    finally:
+        im.close()
     logging.info(f"TimerTrigger - Run Complete")
     
 
@@ -0,0 +1,71 @@
+"""Import-time and cold-start measurement for the Function entry points.
+
+Run from the repository root:
+
+    python -m benchmarks.cold_start
+    python -m benchmarks.cold_start --max-import-ms 400
+
+Each measurement runs in a fresh interpreter so nothing is already cached in
+sys.modules. The script exits non-zero if a heavy module is imported by the
+classify path or the import takes longer than --max-import-ms.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+#Modules the HTTP classify path must never pull in
+HEAVY_MODULES = ("selenium", "twitter", "pytz", "numpy")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"import_ms": elapsed * 1000, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure_import(module):
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(module=module)], capture_output=True, text=True)
+    if output.returncode != 0:
+        sys.exit(f"Importing {module} failed:\n{output.stderr.strip().splitlines()[-1]}")
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    #-X importtime lines are "import time: self [us] | cumulative | imported package"
+    slowest = []
+    for line in output.stderr.splitlines():
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) != 3 or not parts[1].isdigit():
+            continue
+        slowest.append((int(parts[1]) / 1000, parts[2]))
+    slowest.sort(reverse=True)
+    result["slowest"] = slowest[:10]
+    result["heavy_modules"] = sorted({name.split(".")[0] for name in result.pop("modules")} & set(HEAVY_MODULES))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="shared_code.impersonation_monitor")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    runs = [measure_import(args.module) for _ in range(args.repeat)]
+    best_ms = min(run["import_ms"] for run in runs)
+    heavy = runs[-1]["heavy_modules"]
+    print(f"{args.module}: best of {args.repeat} cold imports {best_ms:.1f} ms")
+    for cumulative_ms, name in runs[-1]["slowest"]:
+        print(f"  {cumulative_ms:8.1f} ms  {name}")
+    failed = False
+    if heavy:
+        print(f"FAIL: heavy modules imported eagerly: {', '.join(heavy)}")
+        failed = True
+    if args.max_import_ms is not None and best_ms > args.max_import_ms:
+        print(f"FAIL: import took {best_ms:.1f} ms, budget is {args.max_import_ms:.1f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
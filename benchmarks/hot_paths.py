@@ -0,0 +1,261 @@
+"""Microbenchmarks for the per-account hot paths in shared_code.
+
+Runs offline against the fixtures in benchmarks/fixtures and reports
+throughput in records per second, and the memory each result holds on to
+in bytes per record (measured with tracemalloc while the results are kept). Run from the repository root:
+
+    python -m benchmarks.hot_paths
+    python -m benchmarks.hot_paths --save benchmarks/baseline.json
+    python -m benchmarks.hot_paths --compare benchmarks/baseline.json --tolerance 0.15
+    python -m benchmarks.hot_paths --only parse_title --only build_signature
+
+A benchmark whose module can't be imported (e.g. pyodbc without an ODBC
+driver manager) is reported as skipped rather than failing the run.
+--compare exits non-zero when any benchmark is slower than the baseline by
+more than --tolerance.
+"""
+import argparse
+import base64
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+benchmarks = {}
+
+
+#Registers a setup function that returns (function to call per record, list of records)
+def benchmark(name):
+    def register(setup):
+        benchmarks[name] = setup
+        return setup
+    return register
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as fixture:
+        if name.endswith(".json"):
+            return json.load(fixture)
+        return fixture.read()
+
+
+def account_rows(name, datetime_columns):
+    rows = []
+    for row in load_fixture("account_rows.json")[name]:
+        rows.append(tuple(datetime.fromisoformat(value) if index in datetime_columns else value for index, value in enumerate(row)))
+    return rows
+
+def linkedin_rows():
+    return account_rows("linkedin_accounts", {7, 8})
+
+def twitter_rows():
+    return account_rows("twitter_accounts", {5, 11, 12})
+
+
+@benchmark("parse_title")
+def setup_parse_title():
+    from shared_code.linkedin_helpers import parse_title, split_title
+    split_title.cache_clear()
+    return parse_title, load_fixture("serp_results.json")["titles"]
+
+@benchmark("grab_username_and_safe_url")
+def setup_grab_username_and_safe_url():
+    from shared_code.linkedin_helpers import grab_username_and_safe_url
+    return grab_username_and_safe_url, load_fixture("serp_results.json")["urls"]
+
+#Far more distinct titles than split_title's cache holds, so every call is a miss as it is on a full scan
+DISTINCT_RECORDS = 50000
+
+def distinct_titles():
+    titles = load_fixture("serp_results.json")["titles"]
+    return [f"{first}{index} {rest}" for index, (first, _, rest) in enumerate(titles[index % len(titles)].partition(" ") for index in range(DISTINCT_RECORDS))]
+
+def distinct_urls():
+    urls = load_fixture("serp_results.json")["urls"]
+    return [urls[index % len(urls)].replace("/in/", f"/in/{index}-", 1) for index in range(DISTINCT_RECORDS)]
+
+@benchmark("parse_title_distinct")
+def setup_parse_title_distinct():
+    from shared_code.linkedin_helpers import parse_title, split_title
+    split_title.cache_clear()
+    return parse_title, distinct_titles()
+
+@benchmark("grab_username_and_safe_url_distinct")
+def setup_grab_username_and_safe_url_distinct():
+    from shared_code.linkedin_helpers import grab_username_and_safe_url
+    return grab_username_and_safe_url, distinct_urls()
+
+#What stream_accounts_by_keyword does per profile, parse counts included
+@benchmark("build_account_from_result_distinct")
+def setup_build_account_from_result_distinct():
+    from shared_code.linkedin_helpers import build_account_from_result, split_title, PARSE_COUNTERS
+    split_title.cache_clear()
+    parse_counts = dict.fromkeys(PARSE_COUNTERS, 0)
+    return (lambda result: build_account_from_result(result[0], result[1], parse_counts)), list(zip(distinct_titles(), distinct_urls()))
+
+@benchmark("parse_results_page")
+def setup_parse_results_page():
+    from shared_code.linkedin_search import parse_results_page
+    return parse_results_page, [load_fixture("serp_page.html")]
+
+@benchmark("parse_datetime")
+def setup_parse_datetime():
+    from shared_code.twitter_helpers import parse_datetime
+    return parse_datetime, load_fixture("twitter_created_at.json")
+
+@benchmark("to_linkedin_account")
+def setup_to_linkedin_account():
+    from shared_code.crud_helpers import to_linkedin_account
+    return to_linkedin_account, linkedin_rows()
+
+@benchmark("to_linkedin_account_trusted")
+def setup_to_linkedin_account_trusted():
+    from shared_code.crud_helpers import to_linkedin_account
+    return (lambda row: to_linkedin_account(row, trusted=True)), linkedin_rows()
+
+@benchmark("to_twitter_account")
+def setup_to_twitter_account():
+    from shared_code.crud_helpers import to_twitter_account
+    return to_twitter_account, twitter_rows()
+
+@benchmark("to_twitter_account_trusted")
+def setup_to_twitter_account_trusted():
+    from shared_code.crud_helpers import to_twitter_account
+    return (lambda row: to_twitter_account(row, trusted=True)), twitter_rows()
+
+@benchmark("convert_to_params")
+def setup_convert_to_params():
+    from shared_code.crud_helpers import convert_to_params
+    return convert_to_params, twitter_accounts_in()
+
+#Built from the slotted records so the serialization benchmarks don't need pyodbc
+def twitter_accounts_in():
+    from shared_code.models import TwitterAccountIn, TwitterAccountRecord
+    fields = list(TwitterAccountIn.__fields__)
+    return [TwitterAccountIn(**{field: getattr(record, field) for field in fields}) for record in (TwitterAccountRecord(*row) for row in twitter_rows())]
+
+@benchmark("account_json")
+def setup_account_json():
+    from shared_code.serialization import to_json
+    return to_json, twitter_accounts_in()
+
+#What account_json replaced, kept so the gap stays visible
+@benchmark("account_json_pydantic")
+def setup_account_json_pydantic():
+    return (lambda account: account.json()), twitter_accounts_in()
+
+@benchmark("source_account_to_impersonation_account")
+def setup_source_account_to_impersonation_account():
+    from shared_code.crud_helpers import to_linkedin_account
+    from shared_code.impersonation_monitor import source_account_to_impersonation_account
+    return source_account_to_impersonation_account, [to_linkedin_account(row) for row in linkedin_rows()]
+
+@benchmark("source_account_to_impersonation_account_trusted")
+def setup_source_account_to_impersonation_account_trusted():
+    from shared_code.crud_helpers import to_linkedin_account
+    from shared_code.impersonation_monitor import source_account_to_impersonation_account
+    return source_account_to_impersonation_account, [to_linkedin_account(row, trusted=True) for row in linkedin_rows()]
+
+@benchmark("build_signature")
+def setup_build_signature():
+    from shared_code.azure_helpers import build_signature
+    shared_key = base64.b64encode(b"benchmark-shared-key-" * 3).decode()
+    date = "Mon, 01 Jan 2024 00:00:00 GMT"
+    lengths = [len(title) * 4 for title in load_fixture("serp_results.json")["titles"]]
+    return (lambda content_length: build_signature("workspace-id", shared_key, date, content_length, "POST", "application/json", "/api/logs")), lengths
+
+
+#Best of several timed passes over the fixture, each pass repeats the records until it has run for at least min_time
+def measure(function, records, repeats, min_time):
+    best = 0.0
+    for _ in range(repeats):
+        iterations = 0
+        start = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < min_time:
+            for record in records:
+                function(record)
+            iterations += 1
+            elapsed = time.perf_counter() - start
+        best = max(best, iterations * len(records) / elapsed)
+    return best
+
+
+#Bytes still allocated per record while every result is kept, the list holding them isn't counted
+def measure_memory(function, records):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = [function(record) for record in records]
+        retained = tracemalloc.get_traced_memory()[0] - before - sys.getsizeof(kept)
+    finally:
+        tracemalloc.stop()
+    return max(retained, 0) / len(records)
+
+
+def run(names, repeats, min_time):
+    results = {}
+    memory = {}
+    for name in names:
+        try:
+            function, records = benchmarks[name]()
+        except ImportError as e:
+            print(f"{name:50s} skipped (missing dependency: {e.name or e})")
+            continue
+        results[name] = measure(function, records, repeats, min_time)
+        memory[name] = measure_memory(function, records)
+        print(f"{name:50s} {results[name]:>14,.0f} records/s {memory[name]:>10,.0f} bytes/record")
+    return results, memory
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"\n{'benchmark':50s} {'baseline':>14s} {'current':>14s} {'change':>8s}")
+    for name, current in results.items():
+        previous = baseline["results"].get(name)
+        if not previous:
+            print(f"{name:50s} {'-':>14s} {current:>14,.0f} {'new':>8s}")
+            continue
+        change = current / previous - 1
+        flag = ""
+        if change < -tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:50s} {previous:>14,.0f} {current:>14,.0f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", action="append", choices=sorted(benchmarks), help="run only this benchmark, can be repeated")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timed pass")
+    parser.add_argument("--save", help="write results to this JSON baseline file")
+    parser.add_argument("--compare", help="compare against this JSON baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown before --compare fails, as a fraction")
+    args = parser.parse_args()
+
+    #The hot paths log on every bad record, that would swamp the measurement
+    logging.disable(logging.CRITICAL)
+    results, memory = run(args.only or list(benchmarks), args.repeats, args.min_time)
+    if args.save:
+        with open(args.save, "w") as baseline_file:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "created_at": datetime.utcnow().isoformat(), "unit": "records/s", "results": results, "memory_unit": "bytes/record", "memory": memory}, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"\nSaved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,24 +3,37 @@ import base64
 import hmac
 import hashlib
 from datetime import datetime
+import threading
 import requests
 import logging
 from .models import ErrorLog
+from .metrics import run_metrics
 from pprint import pformat
 
 
 
-#Build the API signature
-def build_signature(customer_id, shared_key, date, content_length, method, content_type, resource):
+#The Data Collector API rejects posts larger than 30 MB, leave some headroom
+LOG_ANALYTICS_MAX_BATCH_BYTES = 25 * 1024 * 1024
+LOG_ANALYTICS_MAX_BATCH_RECORDS = 5000
+LOG_ANALYTICS_FLUSH_INTERVAL = 5.0
+
+
+#Sign a request with a shared key that has already been base64 decoded
+def sign_with_decoded_key(customer_id, decoded_key, date, content_length, method, content_type, resource):
   x_headers = 'x-ms-date:' + date
   string_to_hash = method + "\n" + str(content_length) + "\n" + content_type + "\n" + x_headers + "\n" + resource
   bytes_to_hash = str.encode(string_to_hash,'utf-8')  
-  decoded_key = base64.b64decode(shared_key)
   encoded_hash = (base64.b64encode(hmac.new(decoded_key, bytes_to_hash, digestmod=hashlib.sha256).digest())).decode()
   authorization = "SharedKey {}:{}".format(customer_id,encoded_hash)
   return authorization
 
 
+#Build the API signature
+def build_signature(customer_id, shared_key, date, content_length, method, content_type, resource):
+  decoded_key = base64.b64decode(shared_key)
+  return sign_with_decoded_key(customer_id, decoded_key, date, content_length, method, content_type, resource)
+
+
 #Build and send a request to the Log Analytics Workspace via the API
 def post_alert(body, log_type):
   customer_id = os.getenv("LOG_ANALYTICS_CUSTOMER_ID")
@@ -42,7 +55,8 @@ def post_alert(body, log_type):
       'x-ms-date': rfc1123date
   }
   
-  response = requests.post(uri, data=body, headers=headers)
+  with run_metrics.time("post_alert"):
+    response = requests.post(uri, data=body, headers=headers)
   if (response.status_code == 200):
       return True
   else:
@@ -50,6 +64,148 @@ def post_alert(body, log_type):
       logging.error(log_str)
       return False
 
+#Buffers records per Log-Type and posts them as JSON arrays over a single keep-alive session
+class LogAnalyticsClient:
+
+  def __init__(self, customer_id=None, shared_key=None, max_batch_bytes=LOG_ANALYTICS_MAX_BATCH_BYTES, max_batch_records=LOG_ANALYTICS_MAX_BATCH_RECORDS, flush_interval=LOG_ANALYTICS_FLUSH_INTERVAL):
+    self.customer_id = customer_id or os.getenv("LOG_ANALYTICS_CUSTOMER_ID")
+    shared_key = shared_key or os.getenv("LOG_ANALYTICS_SHARED_KEY")
+    self.decoded_key = base64.b64decode(shared_key) if shared_key else None
+    self.resource = '/api/logs'
+    self.content_type = 'application/json'
+    self.uri = f'https://{self.customer_id}.ods.opinsights.azure.com{self.resource}?api-version=2016-04-01'
+    self.max_batch_bytes = max_batch_bytes
+    self.max_batch_records = max_batch_records
+    self.flush_interval = flush_interval
+    self.session = requests.Session()
+    self.buffers = {}
+    self.buffer_sizes = {}
+    self.report = {}
+    self.buffer_lock = threading.Lock()
+    self.send_lock = threading.Lock()
+    #Batches taken from the buffers but not yet sent, flush() waits for them
+    self.in_flight = 0
+    self.sends_done = threading.Condition(self.buffer_lock)
+    self.closed = threading.Event()
+    self.flusher = None
+    if flush_interval:
+      self.flusher = threading.Thread(target=self._flush_periodically, name="LogAnalyticsFlusher", daemon=True)
+      self.flusher.start()
+
+  def _report_for(self, log_type):
+    if log_type not in self.report:
+      self.report[log_type] = {"records_sent": 0, "batches_sent": 0, "records_failed": 0, "batches_failed": 0}
+    return self.report[log_type]
+
+  #Queue a single JSON encoded record, returns False if the record can't be accepted
+  def add(self, body, log_type):
+    if not body:
+      return False
+    if self.closed.is_set():
+      logging.warning(f"Azure Helpers - Log Analytics Client - Add Record - Failed - Client is Closed - Log Type: {log_type}")
+      return False
+    record_size = len(body.encode('utf-8')) + 1 #Account for the separating comma
+    batch = None
+    with self.buffer_lock:
+      records = self.buffers.setdefault(log_type, [])
+      if records and self.buffer_sizes[log_type] + record_size > self.max_batch_bytes:
+        batch = self._take_batch(log_type)
+        records = self.buffers.setdefault(log_type, [])
+      records.append(body)
+      self.buffer_sizes[log_type] = self.buffer_sizes.get(log_type, 1) + record_size
+      if batch is None and len(records) >= self.max_batch_records:
+        batch = self._take_batch(log_type)
+    if batch:
+      self._send_batch(log_type, batch)
+    return True
+
+  #Must be called while holding buffer_lock, every batch taken must then go through _send_batch
+  def _take_batch(self, log_type):
+    batch = self.buffers.pop(log_type, None)
+    self.buffer_sizes.pop(log_type, None)
+    if batch:
+      self.in_flight += 1
+    return batch
+
+  def _send_batch(self, log_type, records):
+    try:
+      return self._post_batch(log_type, records)
+    finally:
+      with self.buffer_lock:
+        self.in_flight -= 1
+        self.sends_done.notify_all()
+
+  def _post_batch(self, log_type, records):
+    body = ("[" + ",".join(records) + "]").encode('utf-8')
+    rfc1123date = datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
+    with self.send_lock:
+      report = self._report_for(log_type)
+      if not self.decoded_key or not self.customer_id:
+        logging.error(f"Azure Helpers - Log Analytics Client - Send Batch - Failed - Workspace Credentials Not Configured - Log Type: {log_type}")
+        report["records_failed"] += len(records)
+        report["batches_failed"] += 1
+        return False
+      signature = sign_with_decoded_key(self.customer_id, self.decoded_key, rfc1123date, len(body), 'POST', self.content_type, self.resource)
+      headers = {
+          'content-type': self.content_type,
+          'Authorization': signature,
+          'Log-Type': log_type,
+          'x-ms-date': rfc1123date
+      }
+      try:
+        with run_metrics.time("log_analytics_post"):
+          response = self.session.post(self.uri, data=body, headers=headers)
+      except requests.RequestException as e:
+        logging.error(f"Azure Helpers - Log Analytics Client - Send Batch - Failed - Log Type: {log_type} - Records: {len(records)} - Msg: {e}")
+        report["records_failed"] += len(records)
+        report["batches_failed"] += 1
+        return False
+      if response.status_code == 200:
+        report["records_sent"] += len(records)
+        report["batches_sent"] += 1
+        run_metrics.count("log_analytics_records_sent", len(records))
+        logging.debug(f"Azure Helpers - Log Analytics Client - Send Batch - Success - Log Type: {log_type} - Records: {len(records)} - Bytes: {len(body)}")
+        return True
+      logging.error(f"Azure Helpers - Log Analytics Client - Send Batch - Failed - Log Type: {log_type} - Records: {len(records)} - Status: {response.status_code} - Text: {response.text}")
+      report["records_failed"] += len(records)
+      report["batches_failed"] += 1
+      return False
+
+  #Send everything currently buffered, for every Log-Type, then wait for batches add() or the background flusher are still sending
+  #Once it returns, the report accounts for every record added before the call
+  def flush(self):
+    with self.buffer_lock:
+      batches = [(log_type, self._take_batch(log_type)) for log_type in list(self.buffers)]
+    for log_type, records in batches:
+      if records:
+        self._send_batch(log_type, records)
+    with self.buffer_lock:
+      self.sends_done.wait_for(lambda: not self.in_flight)
+
+  def _flush_periodically(self):
+    while not self.closed.wait(self.flush_interval):
+      self.flush()
+
+  #Flush remaining records, stop the background flusher and return the per Log-Type ack report
+  def close(self):
+    if self.closed.is_set():
+      return self.report
+    self.closed.set()
+    if self.flusher:
+      self.flusher.join()
+    self.flush()
+    self.session.close()
+    for log_type, report in self.report.items():
+      logging.info(f"Azure Helpers - Log Analytics Client - Closed - Log Type: {log_type} - Records Sent: {report['records_sent']} - Batches Sent: {report['batches_sent']} - Records Failed: {report['records_failed']} - Batches Failed: {report['batches_failed']}")
+    return self.report
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+
 def report_error(result, module="AdminAudits", error_type=None, error_message=None, data=None):
     error_log = ErrorLog(module=module, result=result, errorType=error_type, errorMessage=error_message, data=data, createdAt = datetime.utcnow())
     logging.error(f"Maiasaura Error - Details: \n {pformat(error_log.dict(exclude={'createdAt'}))}")
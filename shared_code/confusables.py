@@ -0,0 +1,55 @@
+import unicodedata
+from .roster import load_roster_index
+
+
+#Lookalike characters folded onto the ASCII letter they imitate, keys are already casefolded
+CONFUSABLE_CHARACTERS = {
+    #Cyrillic
+    'а': 'a', 'в': 'b', 'ԁ': 'd', 'е': 'e', 'ё': 'e', 'һ': 'h', 'і': 'l', 'ї': 'l', 'ј': 'j', 'к': 'k', 'ӏ': 'l', 'м': 'm', 'н': 'h', 'о': 'o', 'р': 'p', 'ԛ': 'q', 'с': 'c', 'ѕ': 's', 'т': 't', 'у': 'y', 'ԝ': 'w', 'х': 'x', 'ь': 'b',
+    #Greek
+    'α': 'a', 'β': 'b', 'ε': 'e', 'η': 'n', 'ι': 'l', 'κ': 'k', 'ν': 'v', 'ο': 'o', 'ρ': 'p', 'τ': 't', 'υ': 'u', 'χ': 'x', 'ω': 'w', 'ζ': 'z',
+    #Digits and symbols standing in for letters
+    '0': 'o', '1': 'l', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b', '9': 'g', '@': 'a', '$': 's', '|': 'l', '!': 'l',
+    #Letters that are hard to tell apart in most fonts
+    'i': 'l',
+}
+CONFUSABLE_TABLE = str.maketrans(CONFUSABLE_CHARACTERS)
+
+#Applied after the single character table, so 'r' + 'n' written with lookalikes still collapses
+CONFUSABLE_SEQUENCES = (('rn', 'm'), ('vv', 'w'), ('cl', 'd'))
+
+
+#Two names with the same skeleton look the same to a reader
+def skeleton(name):
+    if not name:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', name)
+    folded = ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold().translate(CONFUSABLE_TABLE)
+    folded = ''.join(c for c in folded if c.isalnum())
+    for sequence, replacement in CONFUSABLE_SEQUENCES:
+        folded = folded.replace(sequence, replacement)
+    return folded
+
+
+#Hash index from skeleton to protected identities, one dict lookup per discovered name instead of a pairwise comparison
+class SkeletonIndex:
+
+    def __init__(self, roster):
+        self.index = {}
+        for identity, names in roster:
+            for name in names:
+                key = skeleton(name)
+                if key:
+                    self.index.setdefault(key, set()).add(identity)
+
+    def lookup(self, name):
+        return self.index.get(skeleton(name), set())
+
+    #Identities whose skeleton collides with the account's full_name or username
+    def lookalikes(self, account):
+        return self.lookup(account.full_name) | self.lookup(account.username)
+
+
+#None when no roster is configured
+def load_skeleton_index(path=None):
+    return load_roster_index(SkeletonIndex, path)
@@ -1,17 +1,27 @@
 import pyodbc
 import datetime
 import logging
+import os
+import threading
 import time
-from .queries import create_linkedin_account_stmt, read_linkedin_account_by_id_stmt, read_twitter_account_by_id_stmt, update_linkedin_account_stmt, update_twitter_account_stmt, create_twitter_account_stmt, read_linkedin_keywords_stmt, read_twitter_keywords_stmt, upsert_linkedin_account_stmt, upsert_twitter_account_stmt, read_linkedin_impersonation_accounts_stmt, read_twitter_impersonation_accounts_stmt, create_impersonation_account_stmt, clear_impersonation_accounts_table_stmt
+from contextlib import contextmanager
+from .metrics import run_metrics
+from .serialization import to_params
+from .queries import create_linkedin_account_stmt, read_linkedin_account_by_id_stmt, read_twitter_account_by_id_stmt, create_twitter_account_stmt, read_linkedin_keywords_stmt, read_twitter_keywords_stmt, read_linkedin_keywords_version_stmt, read_twitter_keywords_version_stmt, upsert_linkedin_account_stmt, upsert_twitter_account_stmt, read_linkedin_impersonation_accounts_stmt, read_twitter_impersonation_accounts_stmt, create_impersonation_account_stmt, clear_impersonation_accounts_table_stmt, delete_stale_linkedin_impersonation_accounts_stmt, delete_stale_twitter_impersonation_accounts_stmt, update_changed_linkedin_impersonation_accounts_stmt, update_changed_twitter_impersonation_accounts_stmt, insert_missing_linkedin_impersonation_accounts_stmt, insert_missing_twitter_impersonation_accounts_stmt, classify_linkedin_account_stmt, classify_twitter_account_stmt
 from .stored_procedures import create_linkedin_account_procedure, update_linkedin_account_last_seen_at_procedure, create_twitter_account_procedure, update_twitter_account_last_seen_at_procedure
-from .models import LinkedInAccountIn, LinkedInAccount, TwitterAccountIn, TwitterAccount, Keyword, ImpersonationAccountIn, AccountStatusEnum
+from .models import LinkedInAccountIn, LinkedInAccount, TwitterAccountIn, TwitterAccount, Keyword, ImpersonationAccountIn, AccountStatusEnum, ACCOUNT_TYPES, LinkedInAccountRecord, TwitterAccountRecord
 
 
-def to_linkedin_account(row):
+#Trusted reads skip pydantic and return a slotted record with the same attribute names
+def to_linkedin_account(row, trusted=False):
+    if trusted:
+        return LinkedInAccountRecord(*row)
     return LinkedInAccount(account_id=row[0], full_name=row[1], username=row[2], company=row[3], job_title=row[4], account_status=row[5], account_url=row[6], first_seen_at=row[7], last_seen_at=row[8], num_reports=row[9], keyword_id=row[10])
 
 
-def to_twitter_account(row):
+def to_twitter_account(row, trusted=False):
+    if trusted:
+        return TwitterAccountRecord(*row)
     return TwitterAccount(account_id=row[0], full_name=row[1], username=row[2], twitter_account_id=row[3], is_verified=row[4], created_at=row[5], num_followers=row[6], num_friends=row[7], num_statuses=row[8], account_status=row[9], account_url=row[10], first_seen_at=row[11], last_seen_at=row[12], num_reports=row[13], keyword_id=row[14])
 
 def to_keyword(row):
@@ -20,7 +30,7 @@ def to_keyword(row):
     
 
 def convert_to_params(pydantic_object):
-    return tuple(v for k, v in pydantic_object.dict().items())
+    return to_params(pydantic_object)
 
 def connect_to_db(cnxn_str, max_attempts=10):
     attempts = 1
@@ -47,6 +57,87 @@ def connect_to_db(cnxn_str, max_attempts=10):
     return None
 
 
+#Keeps connections open between invocations handled by the same worker, so warm requests skip connect_to_db entirely
+class ConnectionPool:
+
+    def __init__(self, cnxn_str, max_size=4):
+        self.cnxn_str = cnxn_str
+        self.max_size = max_size
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_size)
+
+    def validate(self, cnxn):
+        try:
+            cnxn.cursor().execute("SELECT 1").fetchone()
+            return True
+        except pyodbc.Error as e:
+            logging.warning(f"Crud Helpers - Connection Pool - Discarding Broken Connection - Msg: {e.args}")
+            try:
+                cnxn.close()
+            except pyodbc.Error:
+                pass
+            return False
+
+    #Blocks while max_size connections are checked out (forever unless a timeout is given), returns None if no healthy connection can be made
+    def acquire(self, timeout=None):
+        if not self.slots.acquire(timeout=timeout):
+            logging.warning(f"Crud Helpers - Connection Pool - Acquire - Failed - Timed Out Waiting for a Free Connection - Pool Size: {self.max_size}")
+            return None
+        while True:
+            with self.lock:
+                cnxn = self.idle.pop() if self.idle else None
+            if cnxn is None:
+                break
+            if self.validate(cnxn):
+                logging.debug(f"Crud Helpers - Connection Pool - Acquire - Reused Warm Connection")
+                return cnxn
+        cnxn = connect_to_db(self.cnxn_str)
+        if not cnxn:
+            self.slots.release()
+            return None
+        return cnxn
+
+    def release(self, cnxn, discard=False):
+        if cnxn is None:
+            return
+        try:
+            if discard:
+                cnxn.close()
+            else:
+                cnxn.rollback() #Don't hand an open transaction to the next caller
+                with self.lock:
+                    self.idle.append(cnxn)
+        except pyodbc.Error as e:
+            logging.warning(f"Crud Helpers - Connection Pool - Release - Dropped Connection - Msg: {e.args}")
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        cnxn = self.acquire(timeout)
+        try:
+            yield cnxn
+        finally:
+            self.release(cnxn)
+
+connection_pools = {}
+connection_pools_lock = threading.Lock()
+
+#One pool per connection string for the life of the worker process
+def get_connection_pool(cnxn_str, max_size=None):
+    if not cnxn_str:
+        logging.critical(
+            "Crud Helpers - Get Connection Pool - Failed - Connection String Not Provided")
+        return None
+    with connection_pools_lock:
+        pool = connection_pools.get(cnxn_str)
+        if pool is None:
+            pool = ConnectionPool(cnxn_str, max_size or max(1, int(os.getenv("DATABASE_POOL_SIZE", 4))))
+            connection_pools[cnxn_str] = pool
+    return pool
+
+
 def fetch_linkedin_account_by_id(cnxn, account_id):
     if not isinstance(account_id, int):
         logging.warning(f"Crud Helpers - Fetch LinkedIn Account by ID - Failed - Account ID must be an Integer")
@@ -66,27 +157,34 @@ def fetch_linkedin_account_by_id(cnxn, account_id):
         return None
     return account
 
-def fetch_linkedin_impersonation_accounts(cnxn):
+#Streams rows in chunks of arraysize instead of materializing the whole result set
+def iter_rows(cursor, arraysize=None):
+    cursor.arraysize = arraysize or int(os.getenv("DATABASE_FETCH_ARRAYSIZE", 1000))
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            return
+        yield from rows
+
+def fetch_linkedin_impersonation_accounts(cnxn, arraysize=None):
     query = read_linkedin_impersonation_accounts_stmt
     cursor = cnxn.cursor()
     cursor.execute(query)
-    accounts = []
-    for row in cursor.fetchall():
-        account = to_linkedin_account(row)
-        accounts.append(account)
-    logging.debug(f"Crud Helpers - Fetch LinkedIn Impersonation Accounts - Complete - Total Accounts: {len(accounts)}")
-    return accounts
+    num_accounts = 0
+    for row in iter_rows(cursor, arraysize):
+        yield to_linkedin_account(row, trusted=True)
+        num_accounts += 1
+    logging.debug(f"Crud Helpers - Fetch LinkedIn Impersonation Accounts - Complete - Total Accounts: {num_accounts}")
 
-def fetch_twitter_impersonation_accounts(cnxn):
+def fetch_twitter_impersonation_accounts(cnxn, arraysize=None):
     query = read_twitter_impersonation_accounts_stmt
     cursor = cnxn.cursor()
     cursor.execute(query)
-    accounts = []
-    for row in cursor.fetchall():
-        account = to_twitter_account(row)
-        accounts.append(account)
-    logging.debug(f"Crud Helpers - Fetch Twitter Impersonation Accounts - Complete - Total Accounts: {len(accounts)}")
-    return accounts
+    num_accounts = 0
+    for row in iter_rows(cursor, arraysize):
+        yield to_twitter_account(row, trusted=True)
+        num_accounts += 1
+    logging.debug(f"Crud Helpers - Fetch Twitter Impersonation Accounts - Complete - Total Accounts: {num_accounts}")
 
 def fetch_twitter_account_by_id(cnxn, account_id):
     if not isinstance(account_id, int):
@@ -146,6 +244,60 @@ def upsert_twitter_account(cnxn, account_in):
             f"Crud Helpers - Upsert Twitter Account - Twitter Account ID: {account_in.twitter_account_id} - Msg: {e.args}")
         return None
 
+#Writes accounts in batches of parameter arrays with one commit per batch, a failed batch is retried row by row so one bad row doesn't sink the rest
+def bulk_execute_accounts(cnxn, query, accounts_in, model, batch_size, log_name, describe):
+    result = {"upserted": 0, "failed": []}
+    cursor = cnxn.cursor()
+    cursor.fast_executemany = True
+    batch = []
+
+    def write_batch(batch):
+        try:
+            with run_metrics.time("db_upsert_batch"):
+                cursor.executemany(query, [convert_to_params(account_in) for account_in in batch])
+                cnxn.commit()
+            result["upserted"] += len(batch)
+            return
+        except Exception as e:
+            cnxn.rollback()
+            logging.warning(
+                f"Crud Helpers - {log_name} - Batch Failed - Retrying Row by Row - Batch Size: {len(batch)} - Msg: {e.args}")
+        for account_in in batch:
+            try:
+                with run_metrics.time("db_upsert_row"):
+                    cursor.execute(query, convert_to_params(account_in))
+                    cnxn.commit()
+                result["upserted"] += 1
+            except Exception as e:
+                cnxn.rollback()
+                logging.warning(
+                    f"Crud Helpers - {log_name} - Failed - {describe(account_in)} - Msg: {e.args}")
+                result["failed"].append((account_in, e.args))
+
+    for account_in in accounts_in:
+        if not isinstance(account_in, model):
+            logging.warning(
+                f"Crud Helpers - {log_name} - Input is not {model.__name__} Object - Type: {type(account_in)}")
+            result["failed"].append((account_in, (f"Input is not {model.__name__} Object",)))
+            continue
+        batch.append(account_in)
+        if len(batch) >= batch_size:
+            write_batch(batch)
+            batch = []
+    if batch:
+        write_batch(batch)
+    run_metrics.count("db_rows_upserted", result["upserted"])
+    run_metrics.count("db_rows_failed", len(result["failed"]))
+    logging.debug(
+        f"Crud Helpers - {log_name} - Complete - Upserted: {result['upserted']} - Failed: {len(result['failed'])}")
+    return result
+
+def bulk_upsert_linkedin_accounts(cnxn, accounts_in, batch_size=500):
+    return bulk_execute_accounts(cnxn, upsert_linkedin_account_stmt, accounts_in, LinkedInAccountIn, batch_size, "Bulk Upsert LinkedIn Accounts", lambda account_in: f"Username: {account_in.username.capitalize()}")
+
+def bulk_upsert_twitter_accounts(cnxn, accounts_in, batch_size=500):
+    return bulk_execute_accounts(cnxn, upsert_twitter_account_stmt, accounts_in, TwitterAccountIn, batch_size, "Bulk Upsert Twitter Accounts", lambda account_in: f"Twitter Account ID: {account_in.twitter_account_id}")
+
 def create_impersonation_account(cnxn, account_in):
     if not isinstance(account_in, ImpersonationAccountIn):
         logging.warning(f"Crud Helpers - Create Impersonation Account - Input is not ImpersonationAccountIn Object - Type: {type(account_in)}")
@@ -182,60 +334,149 @@ def clear_impersonation_accounts_table(cnxn):
         )
         return None
 
+#Brings the Impersonation Accounts table in line with the source tables in a single transaction, readers never see a partial table
+def sync_impersonation_accounts(cnxn):
+    cursor = cnxn.cursor()
+    sync_started_at = time.perf_counter()
+    try:
+        cursor.execute(delete_stale_linkedin_impersonation_accounts_stmt, ACCOUNT_TYPES.linkedin)
+        linkedin_deleted = cursor.rowcount
+        cursor.execute(delete_stale_twitter_impersonation_accounts_stmt, ACCOUNT_TYPES.twitter)
+        twitter_deleted = cursor.rowcount
+        cursor.execute(update_changed_linkedin_impersonation_accounts_stmt, ACCOUNT_TYPES.linkedin)
+        linkedin_updated = cursor.rowcount
+        cursor.execute(update_changed_twitter_impersonation_accounts_stmt, ACCOUNT_TYPES.twitter)
+        twitter_updated = cursor.rowcount
+        cursor.execute(insert_missing_linkedin_impersonation_accounts_stmt, ACCOUNT_TYPES.linkedin, ACCOUNT_TYPES.linkedin)
+        linkedin_inserted = cursor.rowcount
+        cursor.execute(insert_missing_twitter_impersonation_accounts_stmt, ACCOUNT_TYPES.twitter, ACCOUNT_TYPES.twitter)
+        twitter_inserted = cursor.rowcount
+        cnxn.commit()
+        run_metrics.record("db_sync_impersonation_accounts", time.perf_counter() - sync_started_at)
+    except Exception as e:
+        cnxn.rollback()
+        logging.warning(
+            f"Crud Helpers - Sync Impersonation Accounts - Failed - Rolled Back - Msg: {e.args}"
+        )
+        return None
+    logging.info(
+        f"Crud Helpers - Sync Impersonation Accounts - Success - LinkedIn Deleted: {linkedin_deleted} - LinkedIn Updated: {linkedin_updated} - LinkedIn Inserted: {linkedin_inserted} - Twitter Deleted: {twitter_deleted} - Twitter Updated: {twitter_updated} - Twitter Inserted: {twitter_inserted}"
+    )
+    return {"linkedin_deleted": linkedin_deleted, "linkedin_updated": linkedin_updated, "linkedin_inserted": linkedin_inserted, "twitter_deleted": twitter_deleted, "twitter_updated": twitter_updated, "twitter_inserted": twitter_inserted}
 
-def fetch_linkedin_keywords(cnxn):
-    keywords = []
+
+def fetch_linkedin_keywords(cnxn, arraysize=None):
     cursor = cnxn.cursor()
     query = read_linkedin_keywords_stmt
-    for row in cursor.execute(query).fetchall():
-        keyword = to_keyword(row)
-        keywords.append(keyword)
-    logging.debug(f"Crud Helpers - Fetch LinkedIn Keywords - Complete - Total Keywords: {len(keywords)}")
-    return keywords
+    num_keywords = 0
+    for row in iter_rows(cursor.execute(query), arraysize):
+        yield to_keyword(row)
+        num_keywords += 1
+    logging.debug(f"Crud Helpers - Fetch LinkedIn Keywords - Complete - Total Keywords: {num_keywords}")
 
 
-def fetch_twitter_keywords(cnxn):
-    keywords = []
+def fetch_twitter_keywords(cnxn, arraysize=None):
     cursor = cnxn.cursor()
     query = read_twitter_keywords_stmt
-    for row in cursor.execute(query).fetchall():
-        keyword = to_keyword(row)
-        keywords.append(keyword)
-    logging.debug(f"Crud Helpers - Fetch Twitter Keywords - Complete - Total Keywords: {len(keywords)}")
-    return keywords
+    num_keywords = 0
+    for row in iter_rows(cursor.execute(query), arraysize):
+        yield to_keyword(row)
+        num_keywords += 1
+    logging.debug(f"Crud Helpers - Fetch Twitter Keywords - Complete - Total Keywords: {num_keywords}")
 
-def update_linkedin_account_status(cnxn, account_id, new_status, num_reports):
-    
+#Keeps keyword lists for the life of the worker process, once the TTL lapses a cheap checksum query decides whether they need fetching again
+class KeywordCache:
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, cnxn, name, fetch_keywords, version_query):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry and now - entry["checked_at"] < self.ttl:
+            return entry["keywords"]
+        try:
+            with run_metrics.time("db_keyword_version_check"):
+                version = tuple(cnxn.cursor().execute(version_query).fetchone())
+        except Exception as e:
+            logging.warning(f"Crud Helpers - Keyword Cache - Version Check Failed - Keywords: {name} - Msg: {e.args}")
+            version = None
+        if entry and version is not None and version == entry["version"]:
+            logging.debug(f"Crud Helpers - Keyword Cache - Unchanged - Keywords: {name}")
+            entry["checked_at"] = now
+            return entry["keywords"]
+        with run_metrics.time("db_keyword_fetch"):
+            keywords = list(fetch_keywords(cnxn))
+        with self.lock:
+            self.entries[name] = {"keywords": keywords, "version": version, "checked_at": now}
+        logging.debug(f"Crud Helpers - Keyword Cache - Refreshed - Keywords: {name} - Total Keywords: {len(keywords)}")
+        return keywords
+
+    def invalidate(self, name=None):
+        with self.lock:
+            if name:
+                self.entries.pop(name, None)
+            else:
+                self.entries.clear()
+
+keyword_cache = KeywordCache(float(os.getenv("KEYWORD_CACHE_TTL", 300)))
+
+#The returned list is shared between callers, don't modify it
+def fetch_cached_linkedin_keywords(cnxn):
+    return keyword_cache.get(cnxn, "linkedin", fetch_linkedin_keywords, read_linkedin_keywords_version_stmt)
+
+def fetch_cached_twitter_keywords(cnxn):
+    return keyword_cache.get(cnxn, "twitter", fetch_twitter_keywords, read_twitter_keywords_version_stmt)
+
+#Returns the updated status and report count, False if the account is missing or protected, None on a database error
+def classify_account(cnxn, account_type, account_id, new_status):
+    if account_type == ACCOUNT_TYPES.linkedin:
+        query = classify_linkedin_account_stmt
+    elif account_type == ACCOUNT_TYPES.twitter:
+        query = classify_twitter_account_stmt
+    else:
+        logging.warning(f"Crud Helpers - Classify Account - Failed - Invalid Account Type - Account Type: {account_type}")
+        return None
     cursor = cnxn.cursor()
-    query = update_linkedin_account_stmt
-    params = tuple([account_id, new_status, num_reports])
     try:
-        cursor.execute(query, params)
+        row = cursor.execute(query, new_status, new_status, account_id).fetchone()
         cnxn.commit()
-        logging.debug(
-            f"Crud Helpers - Update LinkedIn Account Status - Success - Account ID: {account_id}"
-        )
-        return True
     except Exception as e:
+        cnxn.rollback()
         logging.warning(
-            f"Crud Helpers - Update LinkedIn Account Status - Failed - Account ID: {account_id} - Msg: {e.args}"
+            f"Crud Helpers - Classify Account - Failed - Account ID: {account_id} - Msg: {e.args}"
         )
         return None
+    if not row:
+        logging.warning(
+            f"Crud Helpers - Classify Account - No Update - Account Missing, Whitelisted or Disabled - Account ID: {account_id}"
+        )
+        return False
+    logging.debug(
+        f"Crud Helpers - Classify Account - Success - Account ID: {account_id} - Status: {row[1]} - Reports: {row[2]}"
+    )
+    return {"account_id": row[0], "account_status": row[1], "num_reports": row[2]}
 
-def update_twitter_account_status(cnxn, account_id, new_status, num_reports):
-    
+#Applies every classification in one transaction, a database error rolls back the whole batch
+def classify_accounts(cnxn, items):
+    results = []
     cursor = cnxn.cursor()
-    query = update_twitter_account_stmt
-    params = tuple([account_id, new_status, num_reports])
     try:
-        cursor.execute(query, params)
+        for account_type, account_id, new_status in items:
+            query = classify_linkedin_account_stmt if account_type == ACCOUNT_TYPES.linkedin else classify_twitter_account_stmt
+            row = cursor.execute(query, new_status, new_status, account_id).fetchone()
+            results.append({"account_id": row[0], "account_status": row[1], "num_reports": row[2]} if row else False)
         cnxn.commit()
-        logging.debug(
-            f"Crud Helpers - Update Twitter Account Status - Success - Account ID: {account_id}"
-        )
-        return True
     except Exception as e:
+        cnxn.rollback()
         logging.warning(
-            f"Crud Helpers - Update Twitter Account Status - Failed - Account ID: {account_id} - Msg: {e.args}"
+            f"Crud Helpers - Classify Accounts - Failed - Batch Rolled Back - Batch Size: {len(items)} - Msg: {e.args}"
         )
-        return None
\ No newline at end of file
+        return None
+    logging.debug(
+        f"Crud Helpers - Classify Accounts - Complete - Batch Size: {len(items)} - Updated: {sum(1 for result in results if result)}"
+    )
+    return results
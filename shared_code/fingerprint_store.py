@@ -0,0 +1,85 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from .models import LinkedInAccountIn, TwitterAccountIn
+from .serialization import to_json
+
+
+def account_fingerprint_key(account):
+    if isinstance(account, TwitterAccountIn):
+        return f"twitter:{account.twitter_account_id}"
+    if isinstance(account, LinkedInAccountIn):
+        return f"linkedin:{account.username.lower()}"
+    return None
+
+#keyword_id only records which search found the account, it isn't part of the account's content
+def account_content_hash(account):
+    return hashlib.blake2b(to_json(account, exclude={'keyword_id'}).encode('utf-8'), digest_size=16).digest()
+
+
+#Remembers a content hash for every account emitted by earlier runs so unchanged accounts can be skipped
+class FingerprintStore:
+
+    def __init__(self, path=None, max_age_days=None):
+        self.path = path or os.getenv("FINGERPRINT_STORE_PATH") or os.path.join(tempfile.gettempdir(), "spoofsniper_fingerprints.db")
+        if max_age_days is None:
+            max_age_days = float(os.getenv("FINGERPRINT_MAX_AGE_DAYS", 7))
+        self.max_age = max_age_days * 86400
+        #Checked by the pipeline's alert stage and committed from its database stage, the monitor makes sure they take turns
+        self.cnxn = sqlite3.connect(self.path, check_same_thread=False)
+        self.cnxn.execute("CREATE TABLE IF NOT EXISTS fingerprints (account_key TEXT PRIMARY KEY, digest BLOB NOT NULL, emitted_at REAL NOT NULL) WITHOUT ROWID")
+        self.cnxn.commit()
+        self.pending = {}
+        #Fingerprints of accounts that have been stored, only these are written by commit()
+        self.confirmed = {}
+        self.num_changed = 0
+        self.num_unchanged = 0
+
+    #True if the account is new, has changed, or hasn't been emitted within max_age, the new fingerprint is held until it's confirmed and committed
+    def is_changed(self, account):
+        key = account_fingerprint_key(account)
+        if key is None:
+            logging.warning(f"Fingerprint Store - Is Changed - Unsupported Account Type - Type: {type(account)}")
+            return True
+        digest = account_content_hash(account)
+        now = time.time()
+        pending = self.pending.get(key)
+        if pending is not None:
+            row = pending
+        else:
+            row = self.cnxn.execute("SELECT digest, emitted_at FROM fingerprints WHERE account_key=?", (key,)).fetchone()
+        if row is not None and row[0] == digest and now - row[1] < self.max_age:
+            self.num_unchanged += 1
+            return False
+        self.pending[key] = (digest, now)
+        self.num_changed += 1
+        return True
+
+    #Marks accounts as written to the database, hashed again because a later page may already have replaced the pending fingerprint
+    def confirm(self, accounts):
+        now = time.time()
+        for account in accounts:
+            key = account_fingerprint_key(account)
+            if key is not None:
+                self.confirmed[key] = (account_content_hash(account), now)
+
+    #Only call once the confirmed accounts' alerts have been sent, anything unconfirmed or uncommitted is emitted again next run
+    def commit(self):
+        if not self.confirmed:
+            return
+        self.cnxn.executemany(
+            "INSERT OR REPLACE INTO fingerprints (account_key, digest, emitted_at) VALUES (?, ?, ?)",
+            ((key, digest, emitted_at) for key, (digest, emitted_at) in self.confirmed.items()))
+        self.cnxn.commit()
+        for key, (digest, _) in self.confirmed.items():
+            pending = self.pending.get(key)
+            if pending is not None and pending[0] == digest:
+                del self.pending[key]
+        self.confirmed = {}
+
+    def close(self):
+        logging.info(f"Fingerprint Store - Closed - Changed Accounts: {self.num_changed} - Unchanged Accounts: {self.num_unchanged}")
+        self.cnxn.close()
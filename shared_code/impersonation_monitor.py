@@ -1,24 +1,42 @@
-from .linkedin_helpers import LinkedInAgent
-from .twitter_helpers import TwitterAgent
-from .crud_helpers import connect_to_db, fetch_twitter_keywords, fetch_linkedin_keywords, upsert_linkedin_account, upsert_twitter_account, fetch_linkedin_impersonation_accounts, fetch_twitter_impersonation_accounts, create_impersonation_account, clear_impersonation_accounts_table, update_linkedin_account_status, update_twitter_account_status, fetch_linkedin_account_by_id, fetch_twitter_account_by_id
-from .models import LinkedInAccount, TwitterAccount, AccountTypes, ImpersonationAccountIn, AccountStatusEnum
-from .azure_helpers import post_alert
+from .linkedin_search import BrowserPool
+from .crud_helpers import get_connection_pool, fetch_cached_twitter_keywords, fetch_cached_linkedin_keywords, bulk_upsert_linkedin_accounts, bulk_upsert_twitter_accounts, fetch_linkedin_impersonation_accounts, fetch_twitter_impersonation_accounts, create_impersonation_account, clear_impersonation_accounts_table, sync_impersonation_accounts, classify_account, classify_accounts
+from .models import LinkedInAccount, TwitterAccount, LinkedInAccountRecord, TwitterAccountRecord, ImpersonationAccountIn, ACCOUNT_STATUS, ACCOUNT_STATUSES, ACCOUNT_TYPES
+from .serialization import serializer_for, to_json
+from .azure_helpers import LogAnalyticsClient
+from .fingerprint_store import FingerprintStore
+from .scan_checkpoint import ScanCheckpoint
+from .work_queue import create_work_queue, KeywordLeases
+from .pipeline import Pipeline
+from .metrics import run_metrics
 from pydantic import ValidationError
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import queue
+import threading
+import json
 import os
+import time
 import logging
 
 
+#Records come straight from our own tables, so the impersonation account is built without validating it again
+def trusted_record_to_impersonation_account(record, account_type):
+    return ImpersonationAccountIn.construct(source_account_id=record.account_id, source_account_type=account_type, full_name=record.full_name, username=record.username, num_reports=record.num_reports, account_url=record.account_url)
+
+
 def source_account_to_impersonation_account(source_account):
-    account_types = AccountTypes()
+    if isinstance(source_account, LinkedInAccountRecord):
+        return trusted_record_to_impersonation_account(source_account, ACCOUNT_TYPES.linkedin)
+    if isinstance(source_account, TwitterAccountRecord):
+        return trusted_record_to_impersonation_account(source_account, ACCOUNT_TYPES.twitter)
     if isinstance(source_account, LinkedInAccount):
-        account_type = account_types.linkedin
+        account_type = ACCOUNT_TYPES.linkedin
     elif isinstance(source_account, TwitterAccount):
-        account_type = account_types.twitter
+        account_type = ACCOUNT_TYPES.twitter
     else:
         logging.warning(f"Impersonation Monitor - Source Account to Impersonation Account - Failed - Source Account is Invalid Type - Type: {type(source_account)}")
         return None
     try:
-        ia = ImpersonationAccountIn(source_account_id = source_account.account_id, source_account_type=account_type, **source_account.dict())
+        ia = ImpersonationAccountIn(source_account_id = source_account.account_id, source_account_type=account_type, **serializer_for(type(source_account)).dict(source_account))
         return ia
     except ValidationError as ve:
         logging.warning(f"Impersonation Monitor - Source Account to Impersonation Account - Failed - Validation Error - Msg: {ve.json()}")
@@ -26,6 +44,32 @@ def source_account_to_impersonation_account(source_account):
     
 
 
+#Log-Type and bulk upsert used for each platform's accounts
+platform_sinks = {
+    'twitter': ('TwitterAccounts', bulk_upsert_twitter_accounts),
+    'linkedin': ('LinkedInAccounts', bulk_upsert_linkedin_accounts),
+}
+
+
+#Sends one keyword's accounts into the pipeline a results page at a time, then an item with no accounts to mark the keyword finished
+def stream_keyword(pipeline, platform, agent, keyword):
+    for page_accounts in agent.stream_accounts_by_keyword(keyword.keyword_string):
+        pipeline.put((platform, keyword, page_accounts))
+    pipeline.put((platform, keyword, None))
+
+
+#Agents hold a browser session or an API client that isn't safe to share, each worker checks one out for the duration of a search
+def search_with_pooled_agent(agents, create_agent, pipeline, platform, keyword):
+    try:
+        agent = agents.get_nowait()
+    except queue.Empty:
+        agent = create_agent()
+    try:
+        stream_keyword(pipeline, platform, agent, keyword)
+    finally:
+        agents.put(agent)
+
+
 class ImpersonationMonitor:
 
     def __init__(self):
@@ -35,69 +79,361 @@ class ImpersonationMonitor:
                 "Impersonation Monitor - Initialize - Failure - Unable to find Database Connection String")
             raise Exception(
                 "Failed to Initialize Impersonation Monitor - No Connection STring")
-        self.cnxn = connect_to_db(cnxn_str)
+        self.connection_pool = get_connection_pool(cnxn_str)
+        #Seconds update() waits for a second pooled connection before reading on its own
+        self.read_connection_timeout = float(os.getenv("DATABASE_READ_CONNECTION_TIMEOUT", 10))
+        #A scan can hold every pooled connection, classify requests give up instead of hanging until it finishes
+        self.cnxn = self.connection_pool.acquire(timeout=float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 30)))
         if not self.cnxn:
             logging.critical(
                 "Impersonation Monitor - Initialize - Failure - Unable to Connect to Database")
             raise Exception(
                 "Failed to Initialize Impersonation Monitor - Couldn't Connect to DB")
-        self.search_twitter = True
-        self.search_linkedin = True
-        self.twitter_keywords = fetch_twitter_keywords(self.cnxn)
+        self.linkedin_concurrency = max(1, int(os.getenv("LINKEDIN_SCAN_CONCURRENCY", 1)))
+        self.browser_pool = BrowserPool(size=self.linkedin_concurrency)
+        #Agents pull in selenium and python-twitter, they're built on first use so classify requests never pay for them
+        self.linkedin_agent_instance = None
+        self.twitter_agent_instance = None
+        self.search_twitter = False
+        self.search_linkedin = False
+        self.twitter_keywords = iter([])
+        self.linkedin_keywords = iter([])
         self.num_twitter_keywords = 0
         self.num_linkedin_keywords = 0
-        if not self.twitter_keywords:
+        self.num_linkedin_accounts = 0
+        self.num_twitter_accounts = 0
+        self.num_emitted_accounts = 0
+        self.skip_unchanged_accounts = os.getenv("SKIP_UNCHANGED_ACCOUNTS", "true").lower() == "true"
+        self.similarity_threshold = float(os.getenv("SIMILARITY_SCORE_THRESHOLD", 0.5))
+        #Opt-in until the sync's insert column list has been checked against CreateImpersonationAccount
+        self.incremental_update = os.getenv("INCREMENTAL_UPDATE", "false").lower() == "true"
+        self.persist_accounts = os.getenv("PERSIST_ACCOUNTS", "true").lower() == "true"
+        self.upsert_batch_size = max(1, int(os.getenv("UPSERT_BATCH_SIZE", 500)))
+        self.scan_concurrently = os.getenv("SCAN_CONCURRENTLY", "false").lower() == "true"
+        self.twitter_concurrency = max(1, int(os.getenv("TWITTER_SCAN_CONCURRENCY", 4)))
+        #Results pages waiting for the sinks before searching blocks
+        self.pipeline_max_queued = max(1, int(os.getenv("PIPELINE_MAX_QUEUED", 64)))
+        #Fingerprints are only committed for alerts that are already buffered, so filtering and buffering happen as one step
+        self.emit_lock = threading.Lock()
+        self.checkpoint_scans = os.getenv("SCAN_CHECKPOINTS", "true").lower() == "true"
+        #Seconds a scan may run before it stops and leaves the rest of the keywords for the next run, 0 for no limit
+        self.scan_time_budget = float(os.getenv("SCAN_TIME_BUDGET_SECONDS", 0))
+        self.checkpoint = None
+        self.keyword_leases = None
+        self.scan_started_at = None
+
+    def create_twitter_agent(self):
+        from .twitter_helpers import TwitterAgent
+        return TwitterAgent(checkpoint=self.checkpoint)
+
+    def create_linkedin_agent(self):
+        from .linkedin_helpers import LinkedInAgent
+        return LinkedInAgent(browser_pool=self.browser_pool)
+
+    @property
+    def twitter_agent(self):
+        if self.twitter_agent_instance is None:
+            self.twitter_agent_instance = self.create_twitter_agent()
+        return self.twitter_agent_instance
+
+    @property
+    def linkedin_agent(self):
+        if self.linkedin_agent_instance is None:
+            self.linkedin_agent_instance = self.create_linkedin_agent()
+        return self.linkedin_agent_instance
+
+    #Keywords come from the process-level cache and are only loaded when a scan needs them
+    def load_keywords(self):
+        with run_metrics.time("keyword_fetch"):
+            twitter_keywords = fetch_cached_twitter_keywords(self.cnxn)
+            linkedin_keywords = fetch_cached_linkedin_keywords(self.cnxn)
+        if not twitter_keywords:
             logging.warning(
-                "Impersonation Monitor - Initialize - Twitter Search Disabled - No Keywords to Search")
-            self.search_twitter = False
-        else:
-            self.num_twitter_keywords = len(self.twitter_keywords)
-        self.linkedin_keywords = fetch_linkedin_keywords(self.cnxn)
-        if not self.linkedin_keywords:
+                "Impersonation Monitor - Load Keywords - Twitter Search Disabled - No Keywords to Search")
+        if not linkedin_keywords:
             logging.warning(
-                "Impersonation Monitor - Initialize - LinkedIn Search Disabled - No Keywords to Search")
-            self.search_linkedin = False
-        else:
-            self.num_linkedin_keywords = len(self.linkedin_keywords)
-            self.linkedin_keywords = iter(self.linkedin_keywords)
-        if not self.twitter_keywords and not self.linkedin_keywords:
+                "Impersonation Monitor - Load Keywords - LinkedIn Search Disabled - No Keywords to Search")
+        if not twitter_keywords and not linkedin_keywords:
             logging.critical(
-                "Impersonation Monitor - Initialize - Failure - Nothing to Search")
+                "Impersonation Monitor - Load Keywords - Failure - Nothing to Search")
             raise Exception(
-                "Failed to Initialize Impersonation Monitor - No Keywords")
+                "Failed to Load Keywords - No Keywords")
+        self.search_twitter = bool(twitter_keywords)
+        self.search_linkedin = bool(linkedin_keywords)
+        work_queue = create_work_queue(connection_pool=self.connection_pool)
+        if work_queue:
+            #Keywords are shared out through the queue, which also records what's done, so no local checkpoint is kept
+            self.keyword_leases = KeywordLeases(work_queue)
+            logging.info(f"Impersonation Monitor - Load Keywords - Leasing Keywords from the Work Queue - Worker: {self.keyword_leases.worker_id} - Round: {self.keyword_leases.round_id} - Resumed: {self.keyword_leases.resumed}")
+            self.num_twitter_keywords = len(twitter_keywords)
+            self.num_linkedin_keywords = len(linkedin_keywords)
+            twitter_keywords = self.keyword_leases.keywords('twitter', twitter_keywords) if twitter_keywords else []
+            linkedin_keywords = self.keyword_leases.keywords('linkedin', linkedin_keywords) if linkedin_keywords else []
+        elif self.checkpoint_scans:
+            self.checkpoint = ScanCheckpoint()
+            if self.checkpoint.begin():
+                num_keywords = len(twitter_keywords) + len(linkedin_keywords)
+                twitter_keywords = [keyword for keyword in twitter_keywords if not self.checkpoint.is_completed('twitter', keyword.keyword_id)]
+                linkedin_keywords = [keyword for keyword in linkedin_keywords if not self.checkpoint.is_completed('linkedin', keyword.keyword_id)]
+                logging.info(f"Impersonation Monitor - Load Keywords - Resuming Scan - Skipping {num_keywords - len(twitter_keywords) - len(linkedin_keywords)} Completed Keywords")
+        #With a work queue these are the whole keyword list, this worker only searches the share it manages to lease
+        if not self.keyword_leases:
+            self.num_twitter_keywords = len(twitter_keywords)
+            self.num_linkedin_keywords = len(linkedin_keywords)
+        self.twitter_keywords = iter(twitter_keywords)
+        self.linkedin_keywords = iter(linkedin_keywords)
+
+    def open_sinks(self):
+        self.alert_client = LogAnalyticsClient()
+        self.fingerprints = FingerprintStore() if self.skip_unchanged_accounts else None
+        from .metric_history import open_metric_history
+        from .similarity import load_name_scorer
+        from .confusables import load_skeleton_index
+        self.metric_history = open_metric_history()
+        self.name_scorer = load_name_scorer()
+        self.skeleton_index = load_skeleton_index()
+
+    #Ranks accounts against the protected roster and posts the ones that clear the threshold or collide with a protected skeleton
+    def score_accounts(self, keyword, accounts, log_type):
+        if self.name_scorer:
+            scored = self.name_scorer.score_accounts(accounts)
         else:
-            self.twitter_keywords = iter(self.twitter_keywords)
-        self.linkedin_agent = LinkedInAgent()
-        self.twitter_agent = TwitterAgent()
-        self.num_linkedin_accounts = 0
-        self.num_twitter_accounts = 0
+            scored = [(account, 0.0, None) for account in accounts]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        for account, score, identity in scored:
+            lookalikes = sorted(self.skeleton_index.lookalikes(account)) if self.skeleton_index else []
+            if score < self.similarity_threshold and not lookalikes:
+                continue
+            record = {"account_url": account.account_url, "username": account.username, "full_name": account.full_name, "source_log_type": log_type, "keyword_id": keyword.keyword_id, "similarity_score": round(score, 4), "matched_identity": identity, "lookalike_identities": lookalikes}
+            self.alert_client.add(json.dumps(record), 'AccountSimilarityScores')
+
+    #completed is False when the scan raised or a sink stage failed, the accounts dropped after the failure were never stored
+    def close_sinks(self, completed):
+        alert_report = self.alert_client.close()
+        if self.fingerprints:
+            if not completed:
+                logging.warning("Impersonation Monitor - Scan - Scan Failed - Fingerprints Not Saved, Accounts Will be Emitted Again Next Run")
+            elif any(report["records_failed"] for report in alert_report.values()):
+                logging.warning("Impersonation Monitor - Scan - Some Alerts Failed to Post - Fingerprints Not Saved, Accounts Will be Emitted Again Next Run")
+            else:
+                self.fingerprints.commit()
+            self.fingerprints.close()
+        if self.metric_history:
+            self.metric_history.close()
+
+    #First sink stage: records metrics, drops unchanged accounts, then queues alerts and similarity scores for Log Analytics
+    def alert_stage(self, item):
+        platform, keyword, accounts = item
+        if accounts is None:
+            return item
+        log_type, _ = platform_sinks[platform]
+        if platform == 'twitter':
+            self.num_twitter_accounts += len(accounts)
+            #Every account found is a snapshot, including the unchanged ones the fingerprints are about to filter out
+            if self.metric_history:
+                self.metric_history.append(accounts)
+        else:
+            self.num_linkedin_accounts += len(accounts)
+        for account in accounts:
+            account.keyword_id = keyword.keyword_id
+        with self.emit_lock:
+            if self.fingerprints:
+                accounts = [account for account in accounts if self.fingerprints.is_changed(account)]
+            for account in accounts:
+                self.alert_client.add(to_json(account), log_type)
+        if not accounts:
+            return None
+        if self.name_scorer or self.skeleton_index:
+            self.score_accounts(keyword, accounts, log_type)
+        self.num_emitted_accounts += len(accounts)
+        return (platform, keyword, accounts)
+
+    #Second sink stage: writes accounts to the database, and saves progress once a keyword's last page has been through both stages
+    def database_stage(self, item):
+        platform, keyword, accounts = item
+        if accounts is None:
+            self.save_progress(platform, keyword)
+            return None
+        log_type, bulk_upsert = platform_sinks[platform]
+        if self.persist_accounts:
+            result = bulk_upsert(self.cnxn, accounts, self.upsert_batch_size)
+            if result["failed"]:
+                logging.warning(f"Impersonation Monitor - Scan - Failed to Upsert {len(result['failed'])} Accounts - Log Type: {log_type} - Keyword ID: {keyword.keyword_id}")
+                failed = {id(account) for account, _ in result["failed"]}
+                accounts = [account for account in accounts if id(account) not in failed]
+        #Only accounts that reached the database are fingerprinted, the rest are emitted and written again next run
+        if self.fingerprints:
+            with self.emit_lock:
+                self.fingerprints.confirm(accounts)
+        return None
+
+    #Searching, alerting and database writes each run on their own thread, so their network waits overlap
+    def open_pipeline(self):
+        return Pipeline([("alerts", self.alert_stage), ("database", self.database_stage)], max_queued=self.pipeline_max_queued)
 
+    #Sends what's buffered and, if it all went through, records the keyword as done so a rerun skips it
+    def save_progress(self, platform, keyword):
+        if not self.checkpoint and not self.keyword_leases:
+            return
+        if self.checkpoint:
+            self.checkpoint.complete_keyword(platform, keyword)
+        with self.emit_lock:
+            self.alert_client.flush()
+            #Counted from the start of the run rather than this flush, a batch that failed earlier (sent when a buffer filled, or by the background flusher)
+            #can hold alerts from this keyword or any keyword still in flight, so after a failure nothing more is checkpointed this run
+            with self.alert_client.send_lock:
+                alerts_failed = any(report["records_failed"] for report in self.alert_client.report.values())
+            if alerts_failed:
+                logging.warning(f"Impersonation Monitor - Save Progress - Some Alerts Failed to Post - Checkpoint Not Saved - Platform: {platform} - Keyword ID: {keyword.keyword_id}")
+                if self.checkpoint:
+                    self.checkpoint.rollback()
+                #A leased keyword is left uncompleted and goes back to the queue when the leases are closed
+                return
+            if self.fingerprints:
+                self.fingerprints.commit()
+        if self.checkpoint:
+            self.checkpoint.commit()
+        if self.keyword_leases:
+            self.keyword_leases.complete(platform, keyword)
+
+    def out_of_time(self):
+        return bool(self.scan_time_budget) and time.monotonic() - self.scan_started_at > self.scan_time_budget
+
+    #Only a scan that searched every keyword lets the next run start over from the first one
+    def finish_checkpoint(self, searched_every_keyword):
+        if self.keyword_leases:
+            self.keyword_leases.close()
+            self.keyword_leases = None
+        if not self.checkpoint:
+            return
+        if searched_every_keyword:
+            self.checkpoint.finish()
+        else:
+            logging.info("Impersonation Monitor - Scan Stopped Early - Remaining Keywords Will be Searched Next Run")
 
     def scan(self):
+        self.load_keywords()
         logging.info(
             f"Impersonation Monitor - Starting Scan - Searching {self.num_twitter_keywords} Twitter Keywords and {self.num_linkedin_keywords} LinkedIn Keywords")
-        twitter_keyword = True
-        linkedin_keyword = True
-        while twitter_keyword or linkedin_keyword:
-            twitter_keyword = next(self.twitter_keywords, None)
-            if twitter_keyword:
-                for account in self.twitter_agent.find_accounts_by_keyword(twitter_keyword.keyword_string):
-                    account.keyword_id = twitter_keyword.keyword_id
-                    post_alert(account.json(), 'TwitterAccounts')
-                    #upsert_twitter_account(self.cnxn, account)
-                    self.num_twitter_accounts += 1
-            linkedin_keyword = next(self.linkedin_keywords, None)
-            if linkedin_keyword:
-                for account in self.linkedin_agent.find_accounts_by_keyword(linkedin_keyword.keyword_string):
-                    account.keyword_id = linkedin_keyword.keyword_id
-                    post_alert(account.json(), 'LinkedInAccounts')
-                    #upsert_linkedin_account(self.cnxn, account)
-                    self.num_linkedin_accounts += 1
+        self.open_sinks()
+        self.scan_started_at = time.monotonic()
+        searched_every_keyword = True
+        completed = False
+        try:
+            with self.open_pipeline() as pipeline:
+                while True:
+                    twitter_keyword = next(self.twitter_keywords, None)
+                    linkedin_keyword = next(self.linkedin_keywords, None)
+                    if not twitter_keyword and not linkedin_keyword:
+                        break
+                    #Only a stop that leaves keywords unsearched counts as an early one
+                    if self.out_of_time():
+                        searched_every_keyword = False
+                        break
+                    if twitter_keyword:
+                        stream_keyword(pipeline, 'twitter', self.twitter_agent, twitter_keyword)
+                    if linkedin_keyword:
+                        stream_keyword(pipeline, 'linkedin', self.linkedin_agent, linkedin_keyword)
+            completed = True
+        finally:
+            self.close_sinks(completed)
+            self.browser_pool.close()
+        self.finish_checkpoint(searched_every_keyword)
+        logging.info(
+            f"Impersonation Monitor - Completed - Found {self.num_linkedin_accounts} LinkedIn Accounts and {self.num_twitter_accounts} Twitter Accounts - Emitted {self.num_emitted_accounts} New or Changed Accounts")
+        return self
+
+    #Search with one worker pool per platform so a slow LinkedIn search never holds up Twitter, every worker feeds the same pipeline
+    def scan_concurrent(self):
+        self.load_keywords()
         logging.info(
-            f"Impersonation Monitor - Completed - Found {self.num_linkedin_accounts} LinkedIn Accounts and {self.num_twitter_accounts} Twitter Accounts")
+            f"Impersonation Monitor - Starting Concurrent Scan - Searching {self.num_twitter_keywords} Twitter Keywords with {self.twitter_concurrency} Workers and {self.num_linkedin_keywords} LinkedIn Keywords with {self.linkedin_concurrency} Workers")
+        twitter_agents = queue.Queue()
+        twitter_agents.put(self.twitter_agent)
+        linkedin_agents = queue.Queue()
+        linkedin_agents.put(self.linkedin_agent)
+        self.open_sinks()
+        self.scan_started_at = time.monotonic()
+        searched_every_keyword = True
+        completed = False
+        pipeline = self.open_pipeline()
+        twitter_pool = ThreadPoolExecutor(max_workers=self.twitter_concurrency, thread_name_prefix="TwitterScan")
+        linkedin_pool = ThreadPoolExecutor(max_workers=self.linkedin_concurrency, thread_name_prefix="LinkedInScan")
+        try:
+            #Each platform keeps at most two keywords per worker in flight, so leased keywords aren't hoarded while other instances sit idle
+            platforms = [
+                {"name": 'twitter', "keywords": self.twitter_keywords, "pool": twitter_pool, "agents": twitter_agents, "create_agent": self.create_twitter_agent, "max_in_flight": 2 * self.twitter_concurrency},
+                {"name": 'linkedin', "keywords": self.linkedin_keywords, "pool": linkedin_pool, "agents": linkedin_agents, "create_agent": self.create_linkedin_agent, "max_in_flight": 2 * self.linkedin_concurrency},
+            ]
+            futures = {}
+
+            def submit_next(platform):
+                keyword = next(platform["keywords"], None)
+                if keyword is None:
+                    return False
+                future = platform["pool"].submit(search_with_pooled_agent, platform["agents"], platform["create_agent"], pipeline, platform["name"], keyword)
+                futures[future] = (keyword, platform)
+                return True
+
+            for platform in platforms:
+                for _ in range(platform["max_in_flight"]):
+                    if not submit_next(platform):
+                        break
+            stopped = False
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    keyword, platform = futures.pop(future)
+                    #A failed sink stage drops everything after it, there's no point searching further
+                    if not stopped and (self.out_of_time() or pipeline.error is not None):
+                        stopped = True
+                        for pending in futures:
+                            pending.cancel()
+                        #Running out of time once every keyword has been handed out leaves nothing unsearched
+                        if pipeline.error is not None or any(next(other["keywords"], None) is not None for other in platforms):
+                            searched_every_keyword = False
+                    if future.cancelled():
+                        searched_every_keyword = False
+                        continue
+                    if not stopped:
+                        submit_next(platform)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logging.error(f"Impersonation Monitor - Concurrent Scan - Keyword Search Failed - Keyword ID: {keyword.keyword_id} - Msg: {e.args}")
+                        searched_every_keyword = False
+            completed = True
+        finally:
+            twitter_pool.shutdown(wait=True)
+            linkedin_pool.shutdown(wait=True)
+            #Everything the searches produced is written before the sinks close
+            try:
+                pipeline.close()
+            except Exception:
+                completed = False
+                raise
+            finally:
+                self.close_sinks(completed)
+                self.browser_pool.close()
+        self.finish_checkpoint(searched_every_keyword)
+        logging.info(
+            f"Impersonation Monitor - Concurrent Scan Completed - Found {self.num_linkedin_accounts} LinkedIn Accounts and {self.num_twitter_accounts} Twitter Accounts - Emitted {self.num_emitted_accounts} New or Changed Accounts")
         return self
     
+    #Applies only the deletes, updates and inserts needed to match the source tables, in one transaction
+    def sync(self):
+        logging.info(
+            "Impersonation Monitor - Starting Incremental Sync")
+        changes = sync_impersonation_accounts(self.cnxn)
+        if changes is None:
+            logging.critical(f"Impersonation Monitor - Sync - Error - Failed to Sync Impersonation Accounts Table")
+            return None
+        logging.info(f"Impersonation Monitor - Sync - Complete - LinkedIn Accounts Added: {changes['linkedin_inserted']} - LinkedIn Accounts Updated: {changes['linkedin_updated']} - LinkedIn Accounts Removed: {changes['linkedin_deleted']} - Twitter Accounts Added: {changes['twitter_inserted']} - Twitter Accounts Updated: {changes['twitter_updated']} - Twitter Accounts Removed: {changes['twitter_deleted']}")
+        return changes
+
     def update(self):
+        if self.incremental_update:
+            return self.sync()
         logging.info(
             "Impersonation Monitor - Starting Update")
         cleared = clear_impersonation_accounts_table(self.cnxn)
@@ -106,66 +442,113 @@ class ImpersonationMonitor:
             return
         num_linkedin_accounts = 0
         num_twitter_accounts = 0
-        for account in fetch_linkedin_impersonation_accounts(self.cnxn):
-            ia = source_account_to_impersonation_account(account)
-            if not ia:
-                logging.warning(f"Impersonation Monitor - Update - Error - Failed to Convert LinkedIn Account to Impersonation Account")
-                continue
-            create_impersonation_account(self.cnxn, ia)
-            num_linkedin_accounts +=1
-        logging.info(f"Impersonation Monitor - Update - LinkedIn Accounts Added to Impersonations Table - Total Acconts: {num_linkedin_accounts}")
-        for account in fetch_twitter_impersonation_accounts(self.cnxn):
-            ia = source_account_to_impersonation_account(account)
-            if not ia:
-                logging.warning(f"Impersonation Monitor - Update - Error - Failed to Convert Twitter Account to Impersonation Account")
-                continue
-            create_impersonation_account(self.cnxn, ia)
-            num_twitter_accounts += 1
-        logging.info(f"Impersonation Monitor - Update - Twitter Accounts Added to Impersonations Table - Total Accounts: {num_twitter_accounts}")
+        #Rows are streamed, reading on a second connection lets inserts start while the read is still open
+        #Without a spare connection (the monitor holds the only one when DATABASE_POOL_SIZE=1) the rows are read up front on the monitor's connection
+        with self.connection_pool.connection(timeout=self.read_connection_timeout) as read_cnxn:
+            if not read_cnxn:
+                logging.warning(f"Impersonation Monitor - Update - No Spare Connection - Reading Accounts Before Inserting Them")
+
+            def read_accounts(fetch_accounts):
+                return fetch_accounts(read_cnxn) if read_cnxn else list(fetch_accounts(self.cnxn))
+
+            for account in read_accounts(fetch_linkedin_impersonation_accounts):
+                ia = source_account_to_impersonation_account(account)
+                if not ia:
+                    logging.warning(f"Impersonation Monitor - Update - Error - Failed to Convert LinkedIn Account to Impersonation Account")
+                    continue
+                create_impersonation_account(self.cnxn, ia)
+                num_linkedin_accounts +=1
+            logging.info(f"Impersonation Monitor - Update - LinkedIn Accounts Added to Impersonations Table - Total Acconts: {num_linkedin_accounts}")
+            for account in read_accounts(fetch_twitter_impersonation_accounts):
+                ia = source_account_to_impersonation_account(account)
+                if not ia:
+                    logging.warning(f"Impersonation Monitor - Update - Error - Failed to Convert Twitter Account to Impersonation Account")
+                    continue
+                create_impersonation_account(self.cnxn, ia)
+                num_twitter_accounts += 1
+            logging.info(f"Impersonation Monitor - Update - Twitter Accounts Added to Impersonations Table - Total Accounts: {num_twitter_accounts}")
         logging.info(f"Impersonation Monitor - Update - Complete - Total LinkedIn Accounts: {num_linkedin_accounts} - Total Twitter Accounts: {num_twitter_accounts}")
     
-    def classify(self, account_id, account_type, new_status):
+    #Returns the reason a classification request can't be applied, or None if it's valid
+    def validate_classification(self, account_id, account_type, new_status):
         if not isinstance(account_id, int):
-            logging.warning("Impersonation Monitor - Classify - Failed - Accound ID must be Integer")
-            return None
-        if not new_status in [(v) for k, v in AccountStatusEnum().dict().items()]:
-            logging.warning(f"Impersonation Monitor - Classify - Failed - New Status is Invalid - New Status: {new_status}")
-            return None
-        if account_type == AccountTypes().linkedin:
-            account = fetch_linkedin_account_by_id(self.cnxn, account_id)
-        elif account_type == AccountTypes().twitter:
-            account = fetch_twitter_account_by_id(self.cnxn, account_id)
-        else:
-            logging.warning(f"Impersonation Monitor - Classify - Failed - Invalid Account Type - Account ID: {account_id}")
-            return None
-        if not account:
-            logging.warning(f"Impersonation Monitor - Classify - Failed - Account Not Found in Database - Account ID: {account_id}")
-            return None
-        if account.account_status == AccountStatusEnum().WHITELIST:
-            logging.warning(f"Impersonation Monitor - Classify - Failed - Can't Modify a Whitelisted Account - Account ID: {account.account_id}")
-            return None
-        if account.account_status == AccountStatusEnum().DISABLED:
-            logging.warning(f"Impersonation Monitor - Classify - Failed - Can't Modify a Disabled Account - Account ID: {account.account_id}")
+            return "Account ID must be Integer"
+        if not new_status in ACCOUNT_STATUSES:
+            return f"New Status is Invalid - New Status: {new_status}"
+        if account_type not in (ACCOUNT_TYPES.linkedin, ACCOUNT_TYPES.twitter):
+            return f"Invalid Account Type - Account Type: {account_type}"
+        return None
+
+    def classify(self, account_id, account_type, new_status):
+        invalid = self.validate_classification(account_id, account_type, new_status)
+        if invalid:
+            logging.warning(f"Impersonation Monitor - Classify - Failed - {invalid} - Account ID: {account_id}")
             return None
-        if new_status == AccountStatusEnum().IMPOSTER:
-            logging.debug(f"Impersonation Monitor - Classify - Imposter Account Reported - Account ID: {account.account_id}")
-            account.num_reports += 1 
-        if account_type == AccountTypes().linkedin:
-            updated = update_linkedin_account_status(self.cnxn, account.account_id, new_status, account.num_reports)
-            if not updated:
-                logging.warning(f"Impersonation Monitor - Classify - Failed to Update LinkedIn Account - Account ID: {account.account_id}")
-                return None
-            return True
-        elif account_type == AccountTypes().twitter:
-            updated = update_twitter_account_status(self.cnxn, account_id, new_status, account.num_reports)
-            if not updated:
-                logging.warning(f"Impersonation Monitor - Classify - Failed to Update LinkedIn Account - Account ID: {account.account_id}")
-                return None
-            return True
-        else:
-            logging.warning(f"Impersonation Monitor - Classify - Failed to Update Account - Unknown Account Type - Account Type: {account_type}")
+        updated = classify_account(self.cnxn, account_type, account_id, new_status)
+        if not updated:
+            logging.warning(f"Impersonation Monitor - Classify - Failed - Account Not Found, Whitelisted, Disabled or Update Failed - Account ID: {account_id}")
             return None
+        if new_status == ACCOUNT_STATUS.IMPOSTER:
+            logging.debug(f"Impersonation Monitor - Classify - Imposter Account Reported - Account ID: {account_id} - Total Reports: {updated['num_reports']}")
+        return True
+
+    #Takes (account_id, account_type, new_status) tuples, applies the valid ones in one transaction and returns a result for every item
+    def classify_batch(self, items):
+        results = []
+        valid_items = []
+        for account_id, account_type, new_status in items:
+            result = {"accountId": account_id, "accountType": account_type, "newStatus": new_status, "success": False, "reason": None}
+            result["reason"] = self.validate_classification(account_id, account_type, new_status)
+            if not result["reason"]:
+                valid_items.append((account_type, account_id, new_status))
+            results.append(result)
+        updates = classify_accounts(self.cnxn, valid_items) if valid_items else []
+        if updates is None:
+            logging.warning(f"Impersonation Monitor - Classify Batch - Failed - Database Error - Batch Size: {len(valid_items)}")
+            updates = [None] * len(valid_items)
+        updates = iter(updates)
+        for result in results:
+            if result["reason"]:
+                continue
+            updated = next(updates)
+            if updated:
+                result["success"] = True
+                result["numReports"] = updated["num_reports"]
+            elif updated is None:
+                result["reason"] = "Database Error - Batch Rolled Back"
+            else:
+                result["reason"] = "Account Not Found, Whitelisted or Disabled"
+        logging.info(f"Impersonation Monitor - Classify Batch - Complete - Requested: {len(results)} - Updated: {sum(1 for result in results if result['success'])}")
+        return results
+
+    #Hands the database connection back to the pool for the next invocation on this worker
+    def close(self):
+        self.browser_pool.close()
+        if self.keyword_leases:
+            self.keyword_leases.close()
+            self.keyword_leases = None
+        if self.checkpoint:
+            self.checkpoint.close()
+            self.checkpoint = None
+        if self.cnxn:
+            self.connection_pool.release(self.cnxn)
+            self.cnxn = None
 
+    #One summary record per run in place of a log line per account
     def run(self):
-        self.scan()
-        self.update()
\ No newline at end of file
+        run_metrics.reset()
+        try:
+            with run_metrics.time("scan"):
+                if self.scan_concurrently:
+                    self.scan_concurrent()
+                else:
+                    self.scan()
+            run_metrics.count("accounts_emitted", self.num_emitted_accounts)
+            with run_metrics.time("update"):
+                self.update()
+        finally:
+            #Losing the summary mustn't fail a run that worked or hide the error that stopped one
+            try:
+                run_metrics.emit()
+            except Exception as e:
+                logging.error(f"Impersonation Monitor - Run - Failed to Emit Metrics - Msg: {e.args}")
\ No newline at end of file
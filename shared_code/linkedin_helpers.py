@@ -1,47 +1,59 @@
 import logging
 import os
+import re
+from functools import lru_cache
 from urllib.parse import urlparse
 from .models import LinkedInAccountIn
 from pydantic import ValidationError
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
-from selenium.common.exceptions import NoSuchElementException
+from .linkedin_search import create_search_backend
+from .metrics import run_metrics
 import time
 
+#Resolved once per worker rather than on every title
+COMPANY_NAME = os.getenv("COMPANY_NAME")
+COMPANY_NAME_MODIFIER = os.getenv("COMPANY_NAME_MODIFIER")
+
 def build_profile_url(username: str):
     return f"https://www.linkedin.com/in/{username}/"
 
+#Plain http(s) URLs are split by hand, anything urlparse would treat specially (params, brackets, whitespace, non-ASCII hosts) goes through urlparse
+PLAIN_URL_PATTERN = re.compile(r'([A-Za-z][A-Za-z0-9+.-]*)://([^/?#;\[\]\s]*)([^?#;\[\]\s]*)(?:[?#].*)?', re.DOTALL)
+
+#Run metric counters for SERP parsing, tallied per results page rather than per title
+PARSE_COUNTERS = ("linkedin_titles_parsed", "linkedin_titles_unparsed", "linkedin_urls_parsed", "linkedin_urls_unparsed")
+
+def split_account_url(account_url: str):
+    match = PLAIN_URL_PATTERN.fullmatch(account_url)
+    if match and match.group(2).isascii() and '\t' not in account_url and '\r' not in account_url and '\n' not in account_url:
+        return match.group(1).lower(), match.group(2), match.group(3)
+    parse_result = urlparse(account_url)
+    return parse_result.scheme, parse_result.netloc, parse_result.path
+
 def grab_username_and_safe_url(account_url: str):
     base_url = "linkedin.com"
     base_profile_path = "/in/"
-    parse_result = urlparse(account_url)
     if not account_url:
         logging.warning(f"LinkedIn Helpers - Grab Username From URL - Failed - Account URL is None")
         return None
-    if not base_url in parse_result.netloc:
+    scheme, netloc, path = split_account_url(account_url)
+    if not base_url in netloc:
         logging.warning(f"LinkedIn Helpers - Grab Username From URL - Failed - Account URL not Valid for LinkedIn - Account URL: {account_url}")
         return None
     
-    if base_profile_path not in parse_result.path:
-        logging.warning(f"LinkedIn Helpers - Grab Username From URL - Failed - '/in/' Not Found in Account URL Path - Path: {parse_result.path}")
-        return None
-    try:
-        profile_base_stripped = parse_result.path.split(base_profile_path)[1] #Strip /in/ from Path
-        if "/" in profile_base_stripped:
-            profile_base_stripped = profile_base_stripped.split("/")[0]
-    except:
-        logging.warning("LinkedIn Helpers - Grab Username From URL - Failed - Unable to Split Profile Section of URL")
+    if base_profile_path not in path:
+        logging.warning(f"LinkedIn Helpers - Grab Username From URL - Failed - '/in/' Not Found in Account URL Path - Path: {path}")
         return None
-    safe_url = parse_result._replace(params='', query='', fragment='', path=f"/in/{profile_base_stripped}").geturl()
-    return {"username" : ''.join(e for e in profile_base_stripped if e.isalnum()), "url": safe_url}
+    profile_base_stripped = path.split(base_profile_path, 2)[1].partition("/")[0] #Strip /in/ from Path
+    safe_url = f"{scheme}://{netloc}/in/{profile_base_stripped}" if scheme else f"//{netloc}/in/{profile_base_stripped}"
+    return {"username" : ''.join(filter(str.isalnum, profile_base_stripped)), "url": safe_url}
 
 def grab_details_from_title(title: str):
     if not title:
         logging.warning(f"LinkedIn Helpers - Grab Details from Title - Failed - Title is None")
         return None
     sections = title.split(" - ")
-    company_name = os.getenv("COMPANY_NAME")
-    company_name_modifier = os.getenv("COMPANY_NAME_MODIFIER")
+    company_name = COMPANY_NAME
+    company_name_modifier = COMPANY_NAME_MODIFIER
     full_name = None
     job_title = None
     company_in = ""
@@ -68,51 +80,51 @@ def grab_details_from_title(title: str):
     logging.debug(f"LinkedIn Helpers - Grab Details from Title - Completed - Full Name: {full_name} - Job Title: {job_title} - Company: {company}")
     return {"full_name" : full_name, "job_title": job_title, "company": company}
 
-def parse_title(title: str):
-    full_name = None
-    job_title = None
-    company = None
-    if not title:
-        logging.warning(f"LinkedIn Helpers - Grab Details from Title - Failed - Title is None")
-        return None
-    if "|" in title:
-        title = title.split("|")[0]
-    if "..." in title:
-        title = title.split("...")[0]
+#Memoized on the title, search results repeat the same profiles across keywords and pages
+@lru_cache(maxsize=int(os.getenv("LINKEDIN_TITLE_CACHE_SIZE", 4096)))
+def split_title(title: str):
+    title = title.partition("|")[0]
+    title = title.partition("...")[0]
     if "–" in title:
-        sections = title.split(" – ")
+        sections = title.split(" – ", 3)
     else:
-        sections = title.split(" - ")
-    if not sections:
-        logging.warning(f"LinkedIn Helpers - Grab Details from Title - Failed - Failed to Split Title into Sections - Title: {title}")
-        return None
+        sections = title.split(" - ", 3)
     if len(sections) == 1:
         logging.warning(f"LinkedIn Helpers - Grab Details from Title - Failed - Only 1 Section in Title - Title: {title}")
         return None
     elif len(sections) == 2:
         #format is Full Name - City, State | Professional Profile
-        full_name = sections[0]
+        return (sections[0], None, None)
     elif len(sections) == 3:
-        full_name = sections[0]
-        job_title = sections[1]
-        company = sections[2]
-    else:
-        logging.warning(f"LinkedIn Helpers - Grab Details from Title - Error - Found TItle with 4 Sections - Title: {title}")
+        return (sections[0], sections[1], sections[2])
+    logging.warning(f"LinkedIn Helpers - Grab Details from Title - Error - Found TItle with 4 Sections - Title: {title}")
+    return None
+
+def parse_title(title: str):
+    if not title:
+        logging.warning(f"LinkedIn Helpers - Grab Details from Title - Failed - Title is None")
         return None
-    return {"full_name" : full_name, "job_title": job_title, "company": company}
+    sections = split_title(title)
+    if not sections:
+        return None
+    return {"full_name" : sections[0], "job_title": sections[1], "company": sections[2]}
     
 
 
-def parse_account_data_to_account(account_data):
-    profile_url = account_data.get_attribute('href')
+#parse_counts, when given, is a PARSE_COUNTERS dict the caller tallies a whole page into before reporting it to run_metrics
+def build_account_from_result(profile_title, profile_url, parse_counts=None):
     account = None
     url_details = grab_username_and_safe_url(profile_url)
     if not url_details:
         logging.warning(f"LinkedIn Helpers - Parse Account Data to Account - Failed - Unable to Retrieve Username")
+        if parse_counts is not None:
+            parse_counts["linkedin_urls_unparsed"] += 1
         return account
 
-    profile_title = account_data.find_element_by_tag_name("h3").text
     title_details = parse_title(profile_title)
+    if parse_counts is not None:
+        parse_counts["linkedin_urls_parsed"] += 1
+        parse_counts["linkedin_titles_parsed" if title_details else "linkedin_titles_unparsed"] += 1
     if not title_details:
         logging.warning(f"LinkedIn Helpers - Parse Account Data to Account - Failed - Unable to Retrieve Title Details")
         return account
@@ -123,76 +135,58 @@ def parse_account_data_to_account(account_data):
     return account
 
 
-class LinkedInAgent:
+def parse_account_data_to_account(account_data):
+    return build_account_from_result(account_data.find_element_by_tag_name("h3").text, account_data.get_attribute('href'))
 
-    def __init__(self):
-        
-        chrome_options = webdriver.ChromeOptions()
-        chrome_options.add_argument('--headless')
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-dev-shm-usage')
-        chrome_options = chrome_options
-        self.driver = webdriver.Chrome("/usr/local/bin/chromedriver", chrome_options=chrome_options)
-        self.matched_accounts = []
 
+class LinkedInAgent:
 
+    #backend is anything with the SearchBackend interface, LINKEDIN_SEARCH_BACKEND picks one when it isn't given
+    def __init__(self, backend=None, browser_pool=None):
+        self.backend = backend or create_search_backend(browser_pool=browser_pool)
+        self.matched_accounts = []
 
-    
-    def find_accounts_by_keyword(self, keyword):
+    #Yields the accounts on each results page as soon as the page is parsed
+    def stream_accounts_by_keyword(self, keyword):
         if not isinstance(keyword, str):
             logging.critical(f"LinkedInAgent - Failed to Initialize - Keyword is not String - Type: {type(keyword)} - Keyword: {keyword}")
             return
-        
-        self.driver.get('https://www.google.com/')
-        time.sleep(2)
-        search_input = self.driver.find_element_by_name('q')
         # let google find any linkedin user with keyword
         search_string =  f'site:linkedin.com/in/ AND "{keyword}"'
         logging.debug(f"LinkedIn Agent - Search String - {search_string}")
-        search_input.send_keys(search_string)
-        time.sleep(3)
-        search_input.send_keys(Keys.RETURN)
-        
         num_profiles = 0
         num_pages = 0
-        matched_accounts = []
-        # grab all linkedin profiles from first page at Google
-        profile_data = self.driver.find_elements_by_xpath('//*[@class="r"]/a[1]')
-        for profile in profile_data:
-            account_in = parse_account_data_to_account(profile)
-            if not account_in:
-                logging.debug(f"LinkedIn Agent - Parsing Profiles - Failed to Parse")
-                continue
-            matched_accounts.append(account_in)
-            logging.debug(f"LinkedIn Agent - Created Profile - Username: {account_in.username}")
-        num_profiles += len(profile_data)
-        next_page_button = None
-        try:
-            next_page_button = self.driver.find_element_by_xpath("//span[text()='Next']")
-            next_page_button.click()
-            num_pages +=1
-        except NoSuchElementException as nsee:
-            logging.info(f"LinkedIn Agent - Google Search for LinkedIn Accounts Complete - Searched {num_pages} Total Pages - Msg: {nsee.msg}")
-
-        while next_page_button:
-            profile_data = self.driver.find_elements_by_xpath('//*[@class="r"]/a[1]')
-            for profile in profile_data:
-                account_in = parse_account_data_to_account(profile)
+        num_accounts = 0
+        page_requested_at = time.perf_counter()
+        for results in self.backend.search(search_string):
+            run_metrics.record("linkedin_search_page", time.perf_counter() - page_requested_at)
+            num_pages += 1
+            page_accounts = []
+            parse_counts = dict.fromkeys(PARSE_COUNTERS, 0)
+            page_parse_started_at = time.perf_counter()
+            for profile_title, profile_url in results:
+                account_in = build_account_from_result(profile_title, profile_url, parse_counts)
                 if not account_in:
-                    logging.warning(f"LinkedIn Agent - Parsing Profiles - Failed to Parse")
+                    logging.debug("LinkedIn Agent - Parsing Profiles - Failed to Parse")
                     continue
-                logging.debug(f"LinkedIn Agent - Parsing Profiles - Successfully Parsed - Data: {account_in.json()}")
-                matched_accounts.append(account_in)
-                logging.debug(f"LinkedIn Agent - Created Profile - Success - Username: {account_in.username}")
-            num_profiles += len(profile_data)
-            try:
-                next_page_button = self.driver.find_element_by_xpath("//span[text()='Next']")
-                next_page_button.click()
-                num_pages +=1
-            except NoSuchElementException as nsee:
-                logging.debug(f"LinkedIn Agent - Google Search for Linkedin Accounts Complete - Searched {num_pages} Total Pages")
-                next_page_button = None
-            logging.info(f"LinkedIn Agent - Moving on to Next Page - Total Accounts: {len(matched_accounts)} - Total Pages: {num_pages}")
-        logging.info(f"LinkedIn Agent - Account Search Complete - Total Accounts: {len(matched_accounts)} - Total Pages: {num_pages}")
-        return matched_accounts
-            
+                page_accounts.append(account_in)
+                logging.debug("LinkedIn Agent - Created Profile - Success - Username: %s", account_in.username)
+            run_metrics.record("linkedin_parse_page", time.perf_counter() - page_parse_started_at)
+            for name, amount in parse_counts.items():
+                if amount:
+                    run_metrics.count(name, amount)
+            num_profiles += len(results)
+            num_accounts += len(page_accounts)
+            if page_accounts:
+                yield page_accounts
+            logging.info(f"LinkedIn Agent - Moving on to Next Page - Total Accounts: {num_accounts} - Total Pages: {num_pages}")
+            page_requested_at = time.perf_counter()
+        run_metrics.count("linkedin_pages", num_pages)
+        run_metrics.count("linkedin_accounts", num_accounts)
+        logging.info(f"LinkedIn Agent - Account Search Complete - Total Accounts: {num_accounts} - Total Profiles: {num_profiles} - Total Pages: {num_pages}")
+
+    def find_accounts_by_keyword(self, keyword):
+        return [account for page_accounts in self.stream_accounts_by_keyword(keyword) for account in page_accounts]
+
+    def close(self):
+        self.backend.close()
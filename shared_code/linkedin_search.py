@@ -0,0 +1,272 @@
+import logging
+import os
+import queue
+import time
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from urllib.parse import urlparse, parse_qs
+import requests
+
+
+#A search backend turns a Google query into pages of (h3 title, profile href) results
+class SearchBackend:
+
+    def search(self, search_string):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def new_chrome_driver():
+    from selenium import webdriver
+    chrome_options = webdriver.ChromeOptions()
+    chrome_options.add_argument('--headless')
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    return webdriver.Chrome("/usr/local/bin/chromedriver", chrome_options=chrome_options)
+
+
+#Resident memory of a process and all of its descendants, chromedriver's children are the actual Chrome processes
+def process_tree_rss_mb(root_pid):
+    children = {}
+    rss = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/status') as status:
+                fields = dict(line.split(':', 1) for line in status if ':' in line)
+        except OSError:
+            continue
+        pid = int(entry)
+        children.setdefault(int(fields.get('PPid', '0').strip() or 0), []).append(pid)
+        rss[pid] = int(fields.get('VmRSS', '0 kB').split()[0])
+    total_kb = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        total_kb += rss.get(pid, 0)
+        pending.extend(children.get(pid, []))
+    return total_kb / 1024
+
+
+class BrowserSession:
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages_served = 0
+
+    def memory_mb(self):
+        try:
+            return process_tree_rss_mb(self.driver.service.process.pid)
+        except (AttributeError, OSError):
+            return 0
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logging.warning(f"LinkedIn Search - Browser Session - Quit Failed - Msg: {e.args}")
+
+
+#Up to size Chrome sessions, started on first checkout and recycled once they've served max_pages pages or grown past max_memory_mb
+class BrowserPool:
+
+    def __init__(self, size=1, max_pages=None, max_memory_mb=None):
+        self.size = max(1, size)
+        self.max_pages = max_pages or int(os.getenv("LINKEDIN_BROWSER_MAX_PAGES", 50))
+        self.max_memory_mb = max_memory_mb or float(os.getenv("LINKEDIN_BROWSER_MAX_MEMORY_MB", 1024))
+        #Empty slots are None, a checkout that gets one starts a new browser, LIFO so warm sessions are handed out first
+        self.idle = queue.LifoQueue()
+        for _ in range(self.size):
+            self.idle.put(None)
+
+    def checkout(self):
+        session = self.idle.get()
+        if session is None:
+            try:
+                session = BrowserSession(new_chrome_driver())
+            except Exception:
+                self.idle.put(None)
+                raise
+            logging.debug(f"LinkedIn Search - Browser Pool - Started New Browser Session")
+        return session
+
+    def checkin(self, session):
+        if session.pages_served >= self.max_pages:
+            logging.info(f"LinkedIn Search - Browser Pool - Recycling Browser Session - Pages Served: {session.pages_served}")
+            session.quit()
+            self.idle.put(None)
+            return
+        memory_mb = session.memory_mb()
+        if memory_mb >= self.max_memory_mb:
+            logging.info(f"LinkedIn Search - Browser Pool - Recycling Browser Session - Memory: {memory_mb:.0f} MB - Pages Served: {session.pages_served}")
+            session.quit()
+            self.idle.put(None)
+            return
+        self.idle.put(session)
+
+    @contextmanager
+    def session(self):
+        session = self.checkout()
+        try:
+            yield session
+        finally:
+            self.checkin(session)
+
+    #Quits every browser once it's checked back in, the pool can be used again afterwards
+    def close(self, timeout=60):
+        num_closed = 0
+        num_slots = 0
+        for _ in range(self.size):
+            try:
+                session = self.idle.get(timeout=timeout)
+            except queue.Empty:
+                logging.warning(f"LinkedIn Search - Browser Pool - Close - Timed Out Waiting for a Browser Session to be Checked In")
+                break
+            num_slots += 1
+            if session is not None:
+                session.quit()
+                num_closed += 1
+        for _ in range(num_slots):
+            self.idle.put(None)
+        logging.info(f"LinkedIn Search - Browser Pool - Closed - Browser Sessions Quit: {num_closed}")
+
+
+#Each search checks a browser out of the pool, so one backend can serve several threads at once
+class SeleniumSearchBackend(SearchBackend):
+
+    def __init__(self, browser_pool=None):
+        self.owns_pool = browser_pool is None
+        self.browser_pool = browser_pool or BrowserPool(size=1)
+
+    #Title and href are read before moving on, the elements go stale once the next page loads
+    def read_results(self, session):
+        session.pages_served += 1
+        results = []
+        for profile in session.driver.find_elements_by_xpath('//*[@class="r"]/a[1]'):
+            results.append((profile.find_element_by_tag_name("h3").text, profile.get_attribute('href')))
+        return results
+
+    def search(self, search_string):
+        from selenium.webdriver.common.keys import Keys
+        from selenium.common.exceptions import NoSuchElementException
+        with self.browser_pool.session() as session:
+            driver = session.driver
+            driver.get('https://www.google.com/')
+            time.sleep(2)
+            search_input = driver.find_element_by_name('q')
+            search_input.send_keys(search_string)
+            time.sleep(3)
+            search_input.send_keys(Keys.RETURN)
+            yield self.read_results(session)
+            while True:
+                try:
+                    driver.find_element_by_xpath("//span[text()='Next']").click()
+                except NoSuchElementException:
+                    return
+                yield self.read_results(session)
+
+    def close(self):
+        if self.owns_pool:
+            self.browser_pool.close()
+
+
+#Collects the text of every h3 nested in an anchor, along with that anchor's href
+class SearchResultParser(HTMLParser):
+
+    def __init__(self):
+        super().__init__()
+        self.results = []
+        self.href = None
+        self.title_parts = None
+        self.title = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self.href = dict(attrs).get('href')
+            self.title = None
+        elif tag == 'h3' and self.href:
+            self.title_parts = []
+
+    def handle_endtag(self, tag):
+        if tag == 'h3' and self.title_parts is not None:
+            self.title = ' '.join(''.join(self.title_parts).split())
+            self.title_parts = None
+        elif tag == 'a':
+            if self.href and self.title:
+                self.results.append((self.title, unwrap_result_url(self.href)))
+            self.href = None
+            self.title = None
+
+    def handle_data(self, data):
+        if self.title_parts is not None:
+            self.title_parts.append(data)
+
+
+#Google's script-free results link through /url?q=<target>
+def unwrap_result_url(href):
+    if href.startswith('/url?'):
+        query = parse_qs(urlparse(href).query)
+        for key in ('q', 'url'):
+            if query.get(key):
+                return query[key][0]
+    return href
+
+
+def parse_results_page(html):
+    parser = SearchResultParser()
+    parser.feed(html)
+    parser.close()
+    return parser.results
+
+
+#Plain HTTP requests against the results page, no browser needed
+class HttpSearchBackend(SearchBackend):
+
+    def __init__(self, max_pages=None, page_delay=None, results_per_page=10, browser_pool=None):
+        self.max_pages = max_pages or int(os.getenv("LINKEDIN_MAX_PAGES", 10))
+        self.page_delay = float(os.getenv("LINKEDIN_HTTP_PAGE_DELAY", 1)) if page_delay is None else page_delay
+        self.results_per_page = results_per_page
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': os.getenv("LINKEDIN_HTTP_USER_AGENT", 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0 Safari/537.36')})
+
+    def fetch_page(self, search_string, page):
+        params = {'q': search_string, 'start': page * self.results_per_page, 'num': self.results_per_page, 'hl': 'en'}
+        response = self.session.get('https://www.google.com/search', params=params, timeout=30)
+        if response.status_code != 200:
+            logging.warning(f"LinkedIn Search - HTTP Backend - Fetch Page Failed - Page: {page} - Status: {response.status_code}")
+            return None
+        return response.text
+
+    def search(self, search_string):
+        for page in range(self.max_pages):
+            if page:
+                time.sleep(self.page_delay)
+            html = self.fetch_page(search_string, page)
+            if html is None:
+                return
+            results = parse_results_page(html)
+            if not results:
+                return
+            yield results
+
+    def close(self):
+        self.session.close()
+
+
+search_backends = {"selenium": SeleniumSearchBackend, "http": HttpSearchBackend}
+
+def search_backend_name():
+    name = os.getenv("LINKEDIN_SEARCH_BACKEND", "selenium").lower()
+    if name not in search_backends:
+        logging.warning(f"LinkedIn Search - Search Backend Name - Unknown Backend, Falling Back to Selenium - Backend: {name}")
+        return "selenium"
+    return name
+
+#browser_pool is shared by every Selenium backend created with it, the HTTP backend ignores it
+def create_search_backend(name=None, browser_pool=None):
+    name = name or search_backend_name()
+    backend_class = search_backends.get(name, SeleniumSearchBackend)
+    return backend_class(browser_pool=browser_pool)
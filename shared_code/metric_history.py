@@ -0,0 +1,155 @@
+import logging
+import os
+import time
+import numpy as np
+
+#One append-only file per column, row i of every column is the same snapshot
+METRIC_COLUMNS = ('num_followers', 'num_friends', 'num_statuses')
+HISTORY_COLUMNS = {'account_index': np.dtype('<u4'), 'observed_at': np.dtype('<u4'), **{metric: np.dtype('<u4') for metric in METRIC_COLUMNS}}
+
+
+#Columnar history of Twitter account metrics, one snapshot per account per scan
+#Rows are appended in scan order, so each account's snapshots are already in time order
+class MetricHistory:
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.accounts_path = os.path.join(path, 'accounts.txt')
+        self.account_ids = []
+        if os.path.exists(self.accounts_path):
+            with open(self.accounts_path, encoding='utf-8') as accounts_file:
+                self.account_ids = accounts_file.read().split()
+        self.account_indexes = {account_id: index for index, account_id in enumerate(self.account_ids)}
+        self.new_account_ids = []
+        self.pending = {column: [] for column in HISTORY_COLUMNS}
+        self.truncate_partial_rows()
+
+    def column_path(self, column):
+        return os.path.join(self.path, f'{column}.bin')
+
+    #A crash between column writes leaves some columns a row ahead, drop rows that didn't make it into every column
+    def truncate_partial_rows(self):
+        sizes = {column: os.path.getsize(self.column_path(column)) // dtype.itemsize if os.path.exists(self.column_path(column)) else 0 for column, dtype in HISTORY_COLUMNS.items()}
+        num_rows = min(sizes.values())
+        for column, dtype in HISTORY_COLUMNS.items():
+            if sizes[column] > num_rows:
+                logging.warning(f"Metric History - Dropping Partial Rows - Column: {column} - Rows: {sizes[column] - num_rows}")
+                with open(self.column_path(column), 'r+b') as column_file:
+                    column_file.truncate(num_rows * dtype.itemsize)
+
+    def account_index(self, account_id):
+        index = self.account_indexes.get(account_id)
+        if index is None:
+            index = self.account_indexes[account_id] = len(self.account_ids)
+            self.account_ids.append(account_id)
+            self.new_account_ids.append(account_id)
+        return index
+
+    def append(self, accounts, observed_at=None):
+        observed_at = int(observed_at or time.time())
+        for account in accounts:
+            self.pending['account_index'].append(self.account_index(account.twitter_account_id))
+            self.pending['observed_at'].append(observed_at)
+            for metric in METRIC_COLUMNS:
+                self.pending[metric].append(getattr(account, metric) or 0)
+
+    #Account ids are written before the rows that refer to them
+    def flush(self):
+        if self.new_account_ids:
+            with open(self.accounts_path, 'a', encoding='utf-8') as accounts_file:
+                accounts_file.write(''.join(f'{account_id}\n' for account_id in self.new_account_ids))
+            self.new_account_ids = []
+        num_rows = len(self.pending['account_index'])
+        if not num_rows:
+            return 0
+        for column, dtype in HISTORY_COLUMNS.items():
+            with open(self.column_path(column), 'ab') as column_file:
+                column_file.write(np.asarray(self.pending[column], dtype=dtype).tobytes())
+            self.pending[column] = []
+        logging.info(f"Metric History - Flushed - Rows: {num_rows} - Total Accounts: {len(self.account_ids)}")
+        return num_rows
+
+    def close(self):
+        self.flush()
+
+    #Memory-mapped view of a column, only what's flushed is visible
+    def column(self, column):
+        dtype = HISTORY_COLUMNS[column]
+        column_path = self.column_path(column)
+        if not os.path.exists(column_path) or os.path.getsize(column_path) < dtype.itemsize:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(column_path, dtype=dtype, mode='r')
+
+    def columns(self, *names):
+        arrays = [self.column(name) for name in names]
+        num_rows = min(len(array) for array in arrays)
+        return [array[:num_rows] for array in arrays]
+
+    #Snapshots of one account in time order, as (observed_at, metric value) arrays
+    def series(self, account_id, metric='num_followers'):
+        index = self.account_indexes.get(account_id)
+        account_index, observed_at, values = self.columns('account_index', 'observed_at', metric)
+        if index is None:
+            return observed_at[:0], values[:0]
+        rows = np.flatnonzero(account_index == index)
+        return observed_at[rows], values[rows]
+
+    #Change per day between each account's first and last snapshot since `since` (epoch seconds)
+    #Returns parallel arrays: account ids, snapshot counts, first values, last values, elapsed days, rate per day
+    def growth_rates(self, metric='num_followers', since=None):
+        account_index, observed_at, values = self.columns('account_index', 'observed_at', metric)
+        if since is not None:
+            rows = observed_at >= since
+            account_index, observed_at, values = account_index[rows], observed_at[rows], values[rows]
+        if not len(account_index):
+            empty = np.empty(0, dtype=np.float64)
+            return {"account_ids": [], "num_snapshots": np.empty(0, dtype=np.int64), "first": empty, "last": empty, "elapsed_days": empty, "rate_per_day": empty}
+        #Stable, so each account's rows stay in the order they were appended
+        order = np.argsort(account_index, kind='stable')
+        grouped = account_index[order]
+        starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+        ends = np.r_[starts[1:], len(grouped)] - 1
+        first_rows, last_rows = order[starts], order[ends]
+        first = values[first_rows].astype(np.float64)
+        last = values[last_rows].astype(np.float64)
+        elapsed_days = (observed_at[last_rows].astype(np.float64) - observed_at[first_rows]) / 86400
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate_per_day = np.where(elapsed_days > 0, (last - first) / elapsed_days, 0.0)
+        return {
+            "account_ids": [self.account_ids[index] for index in grouped[starts]],
+            "num_snapshots": ends - starts + 1,
+            "first": first,
+            "last": last,
+            "elapsed_days": elapsed_days,
+            "rate_per_day": rate_per_day,
+        }
+
+    #Accounts whose growth rate is an outlier against every other account, scored with a robust z-score (median and MAD)
+    #Returns (account id, rate per day, score) sorted by score, highest first
+    def anomalies(self, metric='num_followers', since=None, threshold=5.0, min_snapshots=2):
+        growth = self.growth_rates(metric, since)
+        eligible = np.flatnonzero((growth["num_snapshots"] >= min_snapshots) & (growth["elapsed_days"] > 0))
+        if not len(eligible):
+            return []
+        rates = growth["rate_per_day"][eligible]
+        median = np.median(rates)
+        mad = np.median(np.abs(rates - median)) * 1.4826
+        if mad == 0:
+            mad = max(np.mean(np.abs(rates - median)), 1.0)
+        scores = (rates - median) / mad
+        flagged = np.flatnonzero(scores >= threshold)
+        flagged = flagged[np.argsort(scores[flagged])[::-1]]
+        return [(growth["account_ids"][eligible[i]], float(rates[i]), float(scores[i])) for i in flagged]
+
+
+#None when no history directory is configured
+def open_metric_history(path=None):
+    path = path or os.getenv("TWITTER_METRIC_HISTORY_PATH")
+    if not path:
+        return None
+    try:
+        return MetricHistory(path)
+    except OSError as e:
+        logging.warning(f"Metric History - Open Metric History - Failed, History Disabled - Path: {path} - Msg: {e.args}")
+        return None
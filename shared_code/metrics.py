@@ -0,0 +1,105 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+#Upper bounds in milliseconds, anything slower lands in the overflow bucket
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class Histogram:
+
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+
+    def record(self, elapsed_ms):
+        index = 0
+        while index < len(HISTOGRAM_BOUNDS_MS) and elapsed_ms > HISTOGRAM_BOUNDS_MS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.min_ms = elapsed_ms if self.min_ms is None else min(self.min_ms, elapsed_ms)
+        self.max_ms = elapsed_ms if self.max_ms is None else max(self.max_ms, elapsed_ms)
+
+    #Upper bound of the bucket holding the given percentile, capped at the observed maximum
+    def percentile(self, fraction):
+        threshold = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= threshold and bucket_count:
+                bound = HISTOGRAM_BOUNDS_MS[index] if index < len(HISTOGRAM_BOUNDS_MS) else self.max_ms
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "min_ms": round(self.min_ms, 3) if self.min_ms is not None else None,
+            "max_ms": round(self.max_ms, 3) if self.max_ms is not None else None,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "buckets": dict(zip([f"le_{bound}" for bound in HISTOGRAM_BOUNDS_MS] + ["overflow"], self.buckets)),
+        }
+
+
+#Timings and counts per stage for one run, aggregated in memory and emitted as a single summary record
+class RunMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = datetime.utcnow()
+            self.histograms = {}
+            self.counters = {}
+
+    def record(self, stage, elapsed_seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.record(elapsed_seconds * 1000)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def summary(self):
+        with self.lock:
+            return {
+                "run_started_at": self.started_at.isoformat(),
+                "run_finished_at": datetime.utcnow().isoformat(),
+                "stages": {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+                "counters": dict(self.counters),
+            }
+
+    def emit(self, log_type='ImpersonationMonitorMetrics'):
+        from .azure_helpers import post_alert
+        summary = self.summary()
+        logging.info(f"Metrics - Run Summary - Stages: {len(summary['stages'])} - Counters: {summary['counters']}")
+        return post_alert(json.dumps(summary), log_type)
+
+
+#Shared by every stage in the worker process, reset at the start of each run
+run_metrics = RunMetrics()
@@ -44,6 +44,31 @@ class LinkedInAccount(LinkedInAccountIn):
     num_reports: int
     account_status: str
 
+
+#Lightweight rows for trusted database reads, same attribute names as the pydantic models but no per-row validation or copying
+class AccountRecord:
+    __slots__ = ()
+
+    #Slots are declared in the same order as the table columns so a row can be unpacked straight in
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+
+class LinkedInAccountRecord(AccountRecord):
+    __slots__ = ("account_id", "full_name", "username", "company", "job_title", "account_status", "account_url", "first_seen_at", "last_seen_at", "num_reports", "keyword_id")
+
+
+class TwitterAccountRecord(AccountRecord):
+    __slots__ = ("account_id", "full_name", "username", "twitter_account_id", "is_verified", "created_at", "num_followers", "num_friends", "num_statuses", "account_status", "account_url", "first_seen_at", "last_seen_at", "num_reports", "keyword_id")
+
+
 class Keyword(BaseModel):
     keyword_id: int
     keyword_string: str
@@ -71,6 +96,11 @@ class AccountTypes(BaseModel):
     linkedin: int = 1
     twitter: int = 2
 
+#Shared instances, the values never change so there's no need to build a new model every time one is checked
+ACCOUNT_STATUS = AccountStatusEnum()
+ACCOUNT_STATUSES = tuple(ACCOUNT_STATUS.dict().values())
+ACCOUNT_TYPES = AccountTypes()
+
 class ErrorLog(BaseModel):
     module: str
     result: str
@@ -0,0 +1,55 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+
+
+#Pages each Twitter keyword took on its last search, kept in memory and in a small SQLite file
+#The scan timer fires once a day and workers start cold, without the file every keyword would be paged one at a time
+class PageBudgets:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.budgets = {}
+        self.cnxn = None
+        try:
+            self.cnxn = sqlite3.connect(self.path, check_same_thread=False)
+            self.cnxn.execute("CREATE TABLE IF NOT EXISTS page_budgets (keyword TEXT PRIMARY KEY, pages INTEGER NOT NULL) WITHOUT ROWID")
+            self.cnxn.commit()
+            self.budgets = dict(self.cnxn.execute("SELECT keyword, pages FROM page_budgets").fetchall())
+        except sqlite3.Error as e:
+            logging.warning(f"Page Budgets - Failed to Open, Budgets Kept in Memory Only - Path: {self.path} - Msg: {e.args}")
+            self.cnxn = None
+        logging.debug(f"Page Budgets - Loaded - Path: {self.path} - Total Keywords: {len(self.budgets)}")
+
+    #0 for keywords that have never been searched
+    def get(self, keyword):
+        return self.budgets.get(keyword, 0)
+
+    def put(self, keyword, pages):
+        with self.lock:
+            if self.budgets.get(keyword) == pages:
+                return
+            self.budgets[keyword] = pages
+            if self.cnxn is None:
+                return
+            try:
+                self.cnxn.execute("INSERT OR REPLACE INTO page_budgets (keyword, pages) VALUES (?, ?)", (keyword, pages))
+                self.cnxn.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Page Budgets - Put - Failed - Keyword: {keyword} - Msg: {e.args}")
+
+
+page_budgets = {}
+page_budgets_lock = threading.Lock()
+
+#Opened once per path and shared by every agent in the worker
+def load_page_budgets(path=None):
+    path = path or os.getenv("TWITTER_PAGE_BUDGET_PATH") or os.path.join(tempfile.gettempdir(), "spoofsniper_page_budgets.db")
+    with page_budgets_lock:
+        budgets = page_budgets.get(path)
+        if budgets is None:
+            budgets = page_budgets[path] = PageBudgets(path)
+    return budgets
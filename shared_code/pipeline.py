@@ -0,0 +1,82 @@
+import logging
+import queue
+import threading
+import time
+from .metrics import run_metrics
+
+#Marks the end of the input, each stage passes it on once everything ahead of it is handled
+PIPELINE_END = object()
+
+
+#Stages run one after another, each on its own thread, joined by bounded queues
+#A stage is (name, function), the function's return value goes to the next stage and None drops the item
+#Producers block in put() while the first queue is full, so a slow sink holds discovery back instead of buffering without limit
+class Pipeline:
+
+    def __init__(self, stages, max_queued=64):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=max_queued) for _ in stages]
+        self.error = None
+        self.closed = False
+        self.threads = []
+        for index, (name, _) in enumerate(stages):
+            thread = threading.Thread(target=self._run_stage, args=(index,), name=f"Pipeline-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _run_stage(self, index):
+        name, function = self.stages[index]
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.queues) else None
+        while True:
+            item = inbox.get()
+            if item is PIPELINE_END:
+                if outbox is not None:
+                    outbox.put(PIPELINE_END)
+                return
+            #After a failure the rest of the input is drained and dropped, so producers never block on a dead stage
+            if self.error is not None:
+                continue
+            try:
+                with run_metrics.time(f"pipeline_{name}"):
+                    result = function(item)
+            except Exception as e:
+                logging.error(f"Pipeline - Stage Failed, Dropping Remaining Items - Stage: {name} - Msg: {e.args}")
+                self.error = e
+                continue
+            if result is not None and outbox is not None:
+                outbox.put(result)
+
+    #Raises the first stage failure, so producers stop searching once results can't be written
+    def put(self, item):
+        if self.error is not None:
+            raise self.error
+        try:
+            self.queues[0].put_nowait(item)
+        except queue.Full:
+            waiting_since = time.perf_counter()
+            self.queues[0].put(item)
+            run_metrics.record("pipeline_backpressure", time.perf_counter() - waiting_since)
+
+    #Waits for everything already queued to pass through every stage, then re-raises a stage failure if there was one
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.queues[0].put(PIPELINE_END)
+            for thread in self.threads:
+                thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        #Don't let a stage failure hide the exception that's already unwinding
+        if exc_type is None:
+            self.close()
+        else:
+            try:
+                self.close()
+            except Exception as e:
+                logging.error(f"Pipeline - Close - Stage Failure While Handling Another Error - Msg: {e.args}")
@@ -4,9 +4,13 @@ read_linkedin_account_by_id_stmt = "SELECT * FROM LinkedInAccounts WHERE account
 read_twitter_account_by_id_stmt = 'SELECT * FROM TwitterAccounts WHERE account_id=?'
 read_linkedin_keywords_stmt = 'SELECT * FROM Keywords WHERE use_on_linkedin=1'
 read_twitter_keywords_stmt = 'SELECT * FROM Keywords WHERE use_on_twitter=1'
+read_linkedin_keywords_version_stmt = 'SELECT COUNT(*), CHECKSUM_AGG(CHECKSUM(*)) FROM Keywords WHERE use_on_linkedin=1'
+read_twitter_keywords_version_stmt = 'SELECT COUNT(*), CHECKSUM_AGG(CHECKSUM(*)) FROM Keywords WHERE use_on_twitter=1'
 
-update_twitter_account_stmt = 'EXEC UpdateTwitterAccountStatus @account_id=?, @account_status=?, @num_reports=?'
-update_linkedin_account_stmt = 'EXEC UpdateLinkedInAccountStatus @account_id=?, @account_status=?, @num_reports=?'
+#Status guard and report increment in a single statement, no row is returned if the account is missing, Whitelisted or Disabled
+#Replaces the UpdateXAccountStatus procs, they take an absolute num_reports which needs a read first and races concurrent classifications
+classify_linkedin_account_stmt = "UPDATE [dbo].[LinkedInAccounts] SET account_status=?, num_reports=num_reports + CASE WHEN ?='Imposter' THEN 1 ELSE 0 END OUTPUT inserted.account_id, inserted.account_status, inserted.num_reports WHERE account_id=? AND account_status NOT IN ('Whitelisted', 'Disabled')"
+classify_twitter_account_stmt = "UPDATE [dbo].[TwitterAccounts] SET account_status=?, num_reports=num_reports + CASE WHEN ?='Imposter' THEN 1 ELSE 0 END OUTPUT inserted.account_id, inserted.account_status, inserted.num_reports WHERE account_id=? AND account_status NOT IN ('Whitelisted', 'Disabled')"
 
 create_linkedin_account_stmt = 'EXEC [dbo].[CreateLinkedInAccount] @full_name=?, @username=?, @company=?, @job_title=?, @account_url=?'
 create_twitter_account_stmt = 'EXEC [dbo].[CreateTwitterAccount] @twitter_account_id=?, @full_name=?, @username=?, @account_url=?, @is_verified=?, @created_at=?, @num_followers=?, @num_friends=?, @num_statuses=?'
@@ -17,4 +21,25 @@ upsert_twitter_account_stmt = 'EXEC [dbo].[UpsertTwitterAccount] @twitter_accoun
 read_linkedin_impersonation_accounts_stmt = "SELECT * FROM [dbo].[LinkedInAccounts] WHERE account_status in ('Unclassified', 'Imposter')"
 read_twitter_impersonation_accounts_stmt = "SELECT * FROM [dbo].[TwitterAccounts] WHERE account_status in ('Unclassified', 'Imposter')"
 
-clear_impersonation_accounts_table_stmt = 'DELETE FROM [dbo].[ImpersonationAccounts] WHERE 1=1'
\ No newline at end of file
+clear_impersonation_accounts_table_stmt = 'DELETE FROM [dbo].[ImpersonationAccounts] WHERE 1=1'
+
+#Rows whose source account is gone or no longer Unclassified/Imposter
+delete_stale_linkedin_impersonation_accounts_stmt = "DELETE ia FROM [dbo].[ImpersonationAccounts] ia WHERE ia.source_account_type=? AND NOT EXISTS (SELECT 1 FROM [dbo].[LinkedInAccounts] src WHERE src.account_id=ia.source_account_id AND src.account_status IN ('Unclassified', 'Imposter'))"
+delete_stale_twitter_impersonation_accounts_stmt = "DELETE ia FROM [dbo].[ImpersonationAccounts] ia WHERE ia.source_account_type=? AND NOT EXISTS (SELECT 1 FROM [dbo].[TwitterAccounts] src WHERE src.account_id=ia.source_account_id AND src.account_status IN ('Unclassified', 'Imposter'))"
+#Rows whose source account changed since it was copied are updated in place, so they keep their account_id and created_at, EXCEPT compares NULLs as equal
+update_changed_linkedin_impersonation_accounts_stmt = "UPDATE ia SET full_name=src.full_name, username=src.username, num_reports=src.num_reports, account_url=src.account_url FROM [dbo].[ImpersonationAccounts] ia INNER JOIN [dbo].[LinkedInAccounts] src ON src.account_id=ia.source_account_id WHERE ia.source_account_type=? AND src.account_status IN ('Unclassified', 'Imposter') AND EXISTS (SELECT src.full_name, src.username, src.num_reports, src.account_url EXCEPT SELECT ia.full_name, ia.username, ia.num_reports, ia.account_url)"
+update_changed_twitter_impersonation_accounts_stmt = "UPDATE ia SET full_name=src.full_name, username=src.username, num_reports=src.num_reports, account_url=src.account_url FROM [dbo].[ImpersonationAccounts] ia INNER JOIN [dbo].[TwitterAccounts] src ON src.account_id=ia.source_account_id WHERE ia.source_account_type=? AND src.account_status IN ('Unclassified', 'Imposter') AND EXISTS (SELECT src.full_name, src.username, src.num_reports, src.account_url EXCEPT SELECT ia.full_name, ia.username, ia.num_reports, ia.account_url)"
+#Writes the columns CreateImpersonationAccount is given plus created_at, the column list hasn't been checked against the procedure yet, hence INCREMENTAL_UPDATE is opt-in
+insert_missing_linkedin_impersonation_accounts_stmt = "INSERT INTO [dbo].[ImpersonationAccounts] (source_account_id, source_account_type, full_name, username, num_reports, account_url, created_at) SELECT src.account_id, ?, src.full_name, src.username, src.num_reports, src.account_url, GETUTCDATE() FROM [dbo].[LinkedInAccounts] src WHERE src.account_status IN ('Unclassified', 'Imposter') AND NOT EXISTS (SELECT 1 FROM [dbo].[ImpersonationAccounts] ia WHERE ia.source_account_type=? AND ia.source_account_id=src.account_id)"
+insert_missing_twitter_impersonation_accounts_stmt = "INSERT INTO [dbo].[ImpersonationAccounts] (source_account_id, source_account_type, full_name, username, num_reports, account_url, created_at) SELECT src.account_id, ?, src.full_name, src.username, src.num_reports, src.account_url, GETUTCDATE() FROM [dbo].[TwitterAccounts] src WHERE src.account_status IN ('Unclassified', 'Imposter') AND NOT EXISTS (SELECT 1 FROM [dbo].[ImpersonationAccounts] ia WHERE ia.source_account_type=? AND ia.source_account_id=src.account_id)"
+#One row per keyword per scan round, leased to a single worker at a time, expired leases can be taken over by any worker
+create_keyword_leases_table_stmt = "IF OBJECT_ID('[dbo].[KeywordLeases]', 'U') IS NULL CREATE TABLE [dbo].[KeywordLeases] (round_id INT NOT NULL, platform VARCHAR(16) NOT NULL, keyword_id INT NOT NULL, leased_by VARCHAR(128) NULL, lease_expires_at DATETIME2 NULL, completed_at DATETIME2 NULL, CONSTRAINT [PK_KeywordLeases] PRIMARY KEY (round_id, platform, keyword_id))"
+enqueue_keyword_lease_stmt = "INSERT INTO [dbo].[KeywordLeases] (round_id, platform, keyword_id) SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM [dbo].[KeywordLeases] WITH (UPDLOCK, HOLDLOCK) WHERE round_id=? AND platform=? AND keyword_id=?)"
+#READPAST skips rows another worker is leasing right now instead of waiting on them
+lease_keywords_stmt = "UPDATE TOP (?) [dbo].[KeywordLeases] WITH (UPDLOCK, READPAST, ROWLOCK) SET leased_by=?, lease_expires_at=DATEADD(second, ?, SYSUTCDATETIME()) OUTPUT inserted.keyword_id WHERE round_id=? AND platform=? AND completed_at IS NULL AND (leased_by IS NULL OR lease_expires_at < SYSUTCDATETIME())"
+renew_keyword_leases_stmt = "UPDATE [dbo].[KeywordLeases] SET lease_expires_at=DATEADD(second, ?, SYSUTCDATETIME()) WHERE round_id=? AND leased_by=? AND completed_at IS NULL"
+complete_keyword_lease_stmt = "UPDATE [dbo].[KeywordLeases] SET completed_at=SYSUTCDATETIME() WHERE round_id=? AND platform=? AND keyword_id=? AND completed_at IS NULL"
+release_keyword_lease_stmt = "UPDATE [dbo].[KeywordLeases] SET leased_by=NULL, lease_expires_at=NULL WHERE round_id=? AND platform=? AND keyword_id=? AND leased_by=? AND completed_at IS NULL"
+delete_old_keyword_leases_stmt = "DELETE FROM [dbo].[KeywordLeases] WHERE round_id < ?"
+#Latest round that still has keywords to search, a run cut short leaves its round here for the next firing to finish
+read_unfinished_keyword_lease_round_stmt = "SELECT MAX(round_id) FROM [dbo].[KeywordLeases] WHERE round_id >= ? AND completed_at IS NULL"
@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+#Size-bounded on-disk cache of API responses, entries expire after ttl seconds and the least recently read are evicted past max_entries
+class ResponseCache:
+
+    def __init__(self, path, ttl=None, max_entries=None):
+        self.path = path
+        self.ttl = float(os.getenv("TWITTER_RESPONSE_CACHE_TTL", 3600)) if ttl is None else ttl
+        self.max_entries = max_entries or int(os.getenv("TWITTER_RESPONSE_CACHE_MAX_ENTRIES", 10000))
+        #Page fetches run on several threads, they share the one connection behind the lock
+        self.lock = threading.Lock()
+        self.cnxn = sqlite3.connect(self.path, check_same_thread=False)
+        #Losing the last few writes on a crash only costs a refetch
+        self.cnxn.execute("PRAGMA journal_mode=WAL")
+        self.cnxn.execute("PRAGMA synchronous=OFF")
+        self.cnxn.execute("CREATE TABLE IF NOT EXISTS responses (cache_key TEXT PRIMARY KEY, payload BLOB NOT NULL, stored_at REAL NOT NULL, read_at REAL NOT NULL) WITHOUT ROWID")
+        self.cnxn.execute("CREATE INDEX IF NOT EXISTS responses_read_at ON responses (read_at)")
+        self.cnxn.commit()
+        #Read times are only needed for eviction, they're held here and written with the next put
+        self.read_times = {}
+        self.num_hits = 0
+        self.num_misses = 0
+
+    #Returns the decoded value, or None when there's no entry or it has expired
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.cnxn.execute("SELECT payload, stored_at FROM responses WHERE cache_key=?", (key,)).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                self.num_misses += 1
+                return None
+            self.read_times[key] = now
+            self.num_hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key, value):
+        payload = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+        now = time.time()
+        with self.lock:
+            self.write_read_times()
+            self.cnxn.execute("INSERT OR REPLACE INTO responses (cache_key, payload, stored_at, read_at) VALUES (?, ?, ?, ?)", (key, payload, now, now))
+            self.cnxn.execute("DELETE FROM responses WHERE stored_at <= ?", (now - self.ttl,))
+            self.cnxn.execute("DELETE FROM responses WHERE cache_key IN (SELECT cache_key FROM responses ORDER BY read_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self.cnxn.commit()
+
+    def write_read_times(self):
+        if self.read_times:
+            self.cnxn.executemany("UPDATE responses SET read_at=? WHERE cache_key=?", ((read_at, key) for key, read_at in self.read_times.items()))
+            self.read_times = {}
+
+    def close(self):
+        logging.info(f"Response Cache - Closed - Path: {self.path} - Hits: {self.num_hits} - Misses: {self.num_misses}")
+        with self.lock:
+            self.write_read_times()
+            self.cnxn.commit()
+            self.cnxn.close()
+
+
+response_caches = {}
+response_caches_lock = threading.Lock()
+
+#Opened once per path and shared by every agent in the worker, None when no cache path is configured
+def load_response_cache(path=None):
+    path = path or os.getenv("TWITTER_RESPONSE_CACHE_PATH")
+    if not path:
+        return None
+    with response_caches_lock:
+        cache = response_caches.get(path)
+        if cache is None:
+            try:
+                cache = response_caches[path] = ResponseCache(path)
+            except sqlite3.Error as e:
+                logging.warning(f"Response Cache - Load Response Cache - Failed to Open, Caching Disabled - Path: {path} - Msg: {e.args}")
+                return None
+    return cache
@@ -0,0 +1,49 @@
+import csv
+import logging
+import os
+
+
+#Roster file is CSV, the first column is the protected identity and any further columns are aliases such as known handles
+def load_roster(path=None):
+    path = path or os.getenv("PROTECTED_ROSTER_PATH")
+    if not path:
+        return None
+    roster = []
+    try:
+        with open(path, newline='', encoding='utf-8') as roster_file:
+            for row in csv.reader(roster_file):
+                names = [name.strip() for name in row if name.strip()]
+                if not names or names[0].startswith('#'):
+                    continue
+                roster.append((names[0], names))
+    except OSError as e:
+        logging.warning(f"Roster - Load Roster - Failed - Path: {path} - Msg: {e.args}")
+        return None
+    logging.debug(f"Roster - Load Roster - Complete - Total Identities: {len(roster)}")
+    return roster
+
+
+#Path -> (modified_at, roster, {index class: index}), the file is parsed once per change and every index built from it is kept alongside
+roster_indexes = {}
+
+#Builds index_class(roster) once per roster file and reuses it in later runs on the same worker, None when no roster is configured
+def load_roster_index(index_class, path=None):
+    path = path or os.getenv("PROTECTED_ROSTER_PATH")
+    if not path:
+        return None
+    try:
+        modified_at = os.path.getmtime(path)
+    except OSError as e:
+        logging.warning(f"Roster - Load Roster Index - Roster Not Found - Path: {path} - Msg: {e.args}")
+        return None
+    cached = roster_indexes.get(path)
+    if not cached or cached[0] != modified_at:
+        roster = load_roster(path)
+        if not roster:
+            return None
+        cached = roster_indexes[path] = (modified_at, roster, {})
+    _, roster, indexes = cached
+    index = indexes.get(index_class)
+    if index is None:
+        index = indexes[index_class] = index_class(roster)
+    return index
@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+#Progress of the current scan, so a run that's cut short is picked up by the next one instead of starting over
+#Keywords are marked complete once their accounts are emitted, Twitter pages are kept until their keyword completes
+class ScanCheckpoint:
+
+    def __init__(self, path=None, max_age_hours=None):
+        self.path = path or os.getenv("SCAN_CHECKPOINT_PATH") or os.path.join(tempfile.gettempdir(), "spoofsniper_checkpoint.db")
+        if max_age_hours is None:
+            max_age_hours = float(os.getenv("SCAN_CHECKPOINT_MAX_AGE_HOURS", 48))
+        self.max_age = max_age_hours * 3600
+        #Twitter page fetches run on several threads
+        self.lock = threading.Lock()
+        self.cnxn = sqlite3.connect(self.path, check_same_thread=False)
+        self.cnxn.execute("CREATE TABLE IF NOT EXISTS scans (scan_id INTEGER PRIMARY KEY, started_at REAL NOT NULL, completed_at REAL)")
+        self.cnxn.execute("CREATE TABLE IF NOT EXISTS completed_keywords (scan_id INTEGER NOT NULL, platform TEXT NOT NULL, keyword_id INTEGER NOT NULL, completed_at REAL NOT NULL, PRIMARY KEY (scan_id, platform, keyword_id)) WITHOUT ROWID")
+        self.cnxn.execute("CREATE TABLE IF NOT EXISTS twitter_pages (scan_id INTEGER NOT NULL, page_key TEXT NOT NULL, keyword_string TEXT NOT NULL, payload TEXT NOT NULL, PRIMARY KEY (scan_id, page_key)) WITHOUT ROWID")
+        self.cnxn.commit()
+        self.scan_id = None
+        self.resumed = False
+        self.completed = set()
+        self.pending = []
+
+    #Resumes the latest unfinished scan if it isn't older than max_age, otherwise starts a new one
+    def begin(self):
+        now = time.time()
+        with self.lock:
+            row = self.cnxn.execute("SELECT scan_id, started_at FROM scans WHERE completed_at IS NULL ORDER BY scan_id DESC LIMIT 1").fetchone()
+            if row is not None and now - row[1] < self.max_age:
+                self.scan_id = row[0]
+                self.resumed = True
+                self.completed = set(self.cnxn.execute("SELECT platform, keyword_id FROM completed_keywords WHERE scan_id=?", (self.scan_id,)).fetchall())
+            else:
+                #Anything unfinished is too old to trust, drop it along with finished scans
+                self.cnxn.execute("DELETE FROM completed_keywords")
+                self.cnxn.execute("DELETE FROM twitter_pages")
+                self.cnxn.execute("DELETE FROM scans")
+                self.scan_id = self.cnxn.execute("INSERT INTO scans (started_at) VALUES (?)", (now,)).lastrowid
+                self.resumed = False
+                self.completed = set()
+            self.cnxn.commit()
+        if self.resumed:
+            logging.info(f"Scan Checkpoint - Resuming Scan - Scan ID: {self.scan_id} - Completed Keywords: {len(self.completed)}")
+        else:
+            logging.info(f"Scan Checkpoint - Starting New Scan - Scan ID: {self.scan_id}")
+        return self.resumed
+
+    def is_completed(self, platform, keyword_id):
+        return (platform, keyword_id) in self.completed
+
+    #Held until commit(), so a keyword is only skipped next run once its accounts have actually been sent
+    def complete_keyword(self, platform, keyword):
+        self.completed.add((platform, keyword.keyword_id))
+        self.pending.append((platform, keyword))
+
+    def commit(self):
+        if not self.pending:
+            return
+        now = time.time()
+        with self.lock:
+            self.cnxn.executemany("INSERT OR REPLACE INTO completed_keywords (scan_id, platform, keyword_id, completed_at) VALUES (?, ?, ?, ?)",
+                ((self.scan_id, platform, keyword.keyword_id, now) for platform, keyword in self.pending))
+            self.cnxn.executemany("DELETE FROM twitter_pages WHERE scan_id=? AND keyword_string=?",
+                ((self.scan_id, keyword.keyword_string) for platform, keyword in self.pending if platform == 'twitter'))
+            self.cnxn.commit()
+        self.pending = []
+
+    #The keywords since the last commit will be searched again next run
+    def rollback(self):
+        for platform, keyword in self.pending:
+            self.completed.discard((platform, keyword.keyword_id))
+        self.pending = []
+
+    #Every keyword was searched, the next run starts a new scan
+    def finish(self):
+        self.commit()
+        with self.lock:
+            self.cnxn.execute("UPDATE scans SET completed_at=? WHERE scan_id=?", (time.time(), self.scan_id))
+            self.cnxn.execute("DELETE FROM twitter_pages WHERE scan_id=?", (self.scan_id,))
+            self.cnxn.commit()
+        logging.info(f"Scan Checkpoint - Scan Finished - Scan ID: {self.scan_id}")
+
+    #Page store for TwitterAgent.fetch_page, pages fetched before a run was cut short are replayed instead of fetched again
+    def get(self, page_key):
+        with self.lock:
+            row = self.cnxn.execute("SELECT payload FROM twitter_pages WHERE scan_id=? AND page_key=?", (self.scan_id, page_key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, page_key, value):
+        keyword_string = json.loads(page_key)[0]
+        with self.lock:
+            self.cnxn.execute("INSERT OR REPLACE INTO twitter_pages (scan_id, page_key, keyword_string, payload) VALUES (?, ?, ?, ?)", (self.scan_id, page_key, keyword_string, json.dumps(value, separators=(',', ':'))))
+            self.cnxn.commit()
+
+    def close(self):
+        with self.lock:
+            self.cnxn.close()
@@ -0,0 +1,100 @@
+import numpy as np
+from .roster import load_roster_index
+
+
+def normalize_name(name):
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in name.casefold()).split())
+
+
+#Padded so short names and word boundaries still produce grams
+def name_ngrams(name, n=3):
+    padded = f" {normalize_name(name)} "
+    if len(padded) < n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+#Dice similarity on character n-grams against every roster entry at once, driven by an inverted index from n-gram to entries
+class NameScorer:
+
+    def __init__(self, roster, n=3, batch_size=256):
+        self.n = n
+        self.batch_size = batch_size
+        self.identities = [identity for identity, _ in roster]
+        self.vocabulary = {}
+        entry_identities = []
+        postings = []
+        entry_sizes = []
+        for identity_index, (_, names) in enumerate(roster):
+            for name in names:
+                grams = name_ngrams(name, n)
+                entry_index = len(entry_identities)
+                entry_identities.append(identity_index)
+                entry_sizes.append(len(grams))
+                for gram in grams:
+                    gram_id = self.vocabulary.setdefault(gram, len(postings))
+                    if gram_id == len(postings):
+                        postings.append([])
+                    postings[gram_id].append(entry_index)
+        self.entry_identities = np.array(entry_identities, dtype=np.int64)
+        self.entry_sizes = np.array(entry_sizes, dtype=np.float64)
+        self.num_entries = len(entry_identities)
+        #CSR layout, entries for gram g are postings_indices[postings_offsets[g]:postings_offsets[g + 1]]
+        self.postings_offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        self.postings_offsets[1:] = np.cumsum([len(entries) for entries in postings])
+        self.postings_indices = np.array([entry for entries in postings for entry in entries], dtype=np.int64)
+
+    def gram_ids(self, name):
+        grams = name_ngrams(name, self.n)
+        return [self.vocabulary[gram] for gram in grams if gram in self.vocabulary], len(grams)
+
+    #Returns (best score, best identity index) arrays, one element per name
+    def score_names(self, names):
+        best_scores = np.zeros(len(names), dtype=np.float64)
+        best_identities = np.full(len(names), -1, dtype=np.int64)
+        if not self.num_entries:
+            return best_scores, best_identities
+        for start in range(0, len(names), self.batch_size):
+            batch = names[start:start + self.batch_size]
+            gram_owners = []
+            gram_ids = []
+            name_sizes = np.empty(len(batch), dtype=np.float64)
+            for row, name in enumerate(batch):
+                ids, size = self.gram_ids(name or '')
+                gram_ids.extend(ids)
+                gram_owners.extend([row] * len(ids))
+                name_sizes[row] = size
+            if not gram_ids:
+                continue
+            gram_ids = np.array(gram_ids, dtype=np.int64)
+            starts = self.postings_offsets[gram_ids]
+            lengths = self.postings_offsets[gram_ids + 1] - starts
+            total = int(lengths.sum())
+            #Expand every (name, gram) pair into the roster entries that share the gram, then count shared grams per (name, entry)
+            run_starts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            entries = self.postings_indices[run_starts + np.arange(total)]
+            owners = np.repeat(np.array(gram_owners, dtype=np.int64), lengths)
+            overlap = np.bincount(owners * self.num_entries + entries, minlength=len(batch) * self.num_entries).reshape(len(batch), self.num_entries)
+            scores = 2.0 * overlap / (name_sizes[:, None] + self.entry_sizes[None, :])
+            best_entries = scores.argmax(axis=1)
+            rows = np.arange(len(batch))
+            best_scores[start:start + len(batch)] = scores[rows, best_entries]
+            best_identities[start:start + len(batch)] = np.where(overlap[rows, best_entries] > 0, self.entry_identities[best_entries], -1)
+        return best_scores, best_identities
+
+    #Scores each account on both full_name and username and keeps the better match
+    def score_accounts(self, accounts):
+        if not accounts:
+            return []
+        names = [account.full_name for account in accounts] + [account.username for account in accounts]
+        scores, identities = self.score_names(names)
+        num_accounts = len(accounts)
+        use_username = scores[num_accounts:] > scores[:num_accounts]
+        best_scores = np.where(use_username, scores[num_accounts:], scores[:num_accounts])
+        best_identities = np.where(use_username, identities[num_accounts:], identities[:num_accounts])
+        return [(account, float(score), self.identities[identity] if identity >= 0 else None) for account, score, identity in zip(accounts, best_scores, best_identities)]
+
+
+#None when no roster is configured
+def load_name_scorer(path=None):
+    return load_roster_index(NameScorer, path)
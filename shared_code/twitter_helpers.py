@@ -1,16 +1,23 @@
-import twitter
 import os
+import json
 from .models import TwitterAccountIn
 #import utils, models
 import logging
-from datetime import datetime
-import pytz
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from .metrics import run_metrics
+from .response_cache import load_response_cache
+from .page_budgets import load_page_budgets
+
+#The only user fields to_account reads, cached responses keep just these
+CACHED_USER_FIELDS = ('id_str', 'name', 'screen_name', 'verified', 'created_at', 'followers_count', 'friends_count', 'statuses_count')
 
 #Finds what seems to be the only DateTime format that both SQL Server and Twitter can Agree on...
 def parse_datetime(datetime_in):
     date_format = '%a %b %d %H:%M:%S'
     try:
-        t = datetime.strptime(datetime_in, date_format).replace(tzinfo=pytz.UTC)
+        t = datetime.strptime(datetime_in, date_format).replace(tzinfo=timezone.utc)
     except ValueError as v:
         if len(v.args) > 0 and v.args[0].startswith('unconverted data remains: '):
             datetime_in = datetime_in[:-(len(v.args[0]) - 26)]
@@ -21,7 +28,8 @@ def parse_datetime(datetime_in):
 
 
 class TwitterAgent:
-    def __init__(self):
+    def __init__(self, checkpoint=None):
+        import twitter #Only the scan needs python-twitter, keep it out of the import path of everything else
         consumer_key=os.getenv("TWITTER_CONSUMER_KEY")
         consumer_secret = os.getenv("TWITTER_CONSUMER_SECRET")
         access_token_key = os.getenv("TWITTER_ACCESS_TOKEN_KEY")
@@ -33,27 +41,108 @@ class TwitterAgent:
         self.matched_accounts = []
         self.account_base_url = 'https://twitter.com/'
         self.num_pages = 20 
+        self.page_size = 50
+        self.page_concurrency = max(1, int(os.getenv("TWITTER_PAGE_CONCURRENCY", 4)))
+        self.response_cache = load_response_cache()
+        self.page_budgets = load_page_budgets()
+        #Pages already fetched by the scan being resumed come first, then the shared response cache
+        self.page_stores = [store for store in (checkpoint, self.response_cache) if store is not None]
 
     def get_account_url(self, username):
         return f"{self.account_base_url}{username.lower()}"
 
+    #users/search pages are 1-indexed, page 0 returns the same results as page 1
+    def fetch_page(self, keyword, page):
+        if not self.page_stores:
+            return self.search_users(keyword, page)
+        #Stored as rows of CACHED_USER_FIELDS values, rebuilt into objects with the same attributes as twitter.User
+        cache_key = json.dumps([keyword, page, self.page_size])
+        for store in self.page_stores:
+            rows = store.get(cache_key)
+            if rows is not None:
+                run_metrics.count("twitter_cached_pages")
+                return [SimpleNamespace(**dict(zip(CACHED_USER_FIELDS, row))) for row in rows]
+        twtr_accounts = self.search_users(keyword, page)
+        rows = [[getattr(twtr_account, field) for field in CACHED_USER_FIELDS] for twtr_account in twtr_accounts]
+        for store in self.page_stores:
+            store.put(cache_key, rows)
+        return twtr_accounts
+
+    def search_users(self, keyword, page):
+        with run_metrics.time("twitter_api_page"):
+            return self.api.GetUsersSearch(term=keyword, page=page, count=self.page_size)
+
+    def to_account(self, twtr_account):
+        with run_metrics.time("twitter_parse"):
+            return self.build_account(twtr_account)
+
+    def build_account(self, twtr_account):
+        account_url = self.get_account_url(twtr_account.screen_name)
+        matched = TwitterAccountIn(twitter_account_id= twtr_account.id_str, full_name= twtr_account.name, username=twtr_account.screen_name, account_url=account_url, is_verified=twtr_account.verified, created_at=parse_datetime(twtr_account.created_at), num_followers=twtr_account.followers_count, num_friends=twtr_account.friends_count, num_statuses=twtr_account.statuses_count)
+        if logging.getLogger().isEnabledFor(logging.DEBUG): #Serializing the account is the expensive part, skip it unless it's logged
+            logging.debug(f"Twitter Agent - Match - Matched New Account - Details: {matched.json()}")
+        return matched
+
+    #Pages a keyword took on its last search, 0 for keywords that have never been searched so they're paged one at a time
+    def page_budget(self, keyword):
+        return self.page_budgets.get(keyword)
 
     #Use Twitter API to search for accounts where screen_name contains user full_name
-    def find_accounts_by_keyword(self, keyword):
-        matched_accounts = []
+    #Yields the new accounts on each page as soon as the page is read
+    def stream_accounts_by_keyword(self, keyword):
         if not isinstance(keyword, str):
             logging.critical(f"TwitterAgent - Failed to Initialize - Keyword is not String - Type: {type(keyword)} - Keyword: {keyword}")
             return
-        page = 0
-        while page < self.num_pages:
-            twtr_accounts = self.api.GetUsersSearch(term=keyword, page=page, count=50)
+        seen_ids = set()
+        num_accounts = 0
+
+        #Returns the accounts not seen on earlier pages, and True while the result set looks like it has more pages
+        def read_page(twtr_accounts):
+            new_accounts = []
             for twtr_account in twtr_accounts:
-                account_url = self.get_account_url(twtr_account.screen_name)
-                matched = TwitterAccountIn(twitter_account_id= twtr_account.id_str, full_name= twtr_account.name, username=twtr_account.screen_name, account_url=account_url, is_verified=twtr_account.verified, created_at=parse_datetime(twtr_account.created_at), num_followers=twtr_account.followers_count, num_friends=twtr_account.friends_count, num_statuses=twtr_account.statuses_count)
-                logging.debug(f"Twitter Agent - Match - Matched New Account - Details: {matched.json()}")
-                matched_accounts.append(matched)    
-            page +=1
-        return matched_accounts
+                if twtr_account.id_str in seen_ids:
+                    continue
+                seen_ids.add(twtr_account.id_str)
+                new_accounts.append(self.to_account(twtr_account))
+            return new_accounts, len(twtr_accounts) >= self.page_size and len(new_accounts) > 0
+
+        page = 1
+        page_accounts, more_pages = read_page(self.fetch_page(keyword, page))
+        num_accounts += len(page_accounts)
+        if page_accounts:
+            yield page_accounts
+        budget = min(self.page_budget(keyword), self.num_pages)
+        if more_pages and budget > 2 and self.page_concurrency > 1:
+            #First page was full and this keyword needed several pages last time, fetch the rest of its budget at once
+            with ThreadPoolExecutor(max_workers=self.page_concurrency, thread_name_prefix="TwitterPages") as pool:
+                futures = [pool.submit(self.fetch_page, keyword, p) for p in range(2, budget + 1)]
+                try:
+                    for future in futures:
+                        if not more_pages:
+                            break
+                        page_accounts, more_pages = read_page(future.result())
+                        page += 1
+                        num_accounts += len(page_accounts)
+                        if page_accounts:
+                            yield page_accounts
+                finally:
+                    #Also runs when the consumer stops early, pages nobody will read aren't fetched
+                    for future in futures:
+                        future.cancel()
+        while more_pages and page < self.num_pages:
+            page += 1
+            page_accounts, more_pages = read_page(self.fetch_page(keyword, page))
+            num_accounts += len(page_accounts)
+            if page_accounts:
+                yield page_accounts
+        next_budget = min(self.num_pages, page + 1)
+        self.page_budgets.put(keyword, next_budget)
+        run_metrics.count("twitter_pages", page)
+        run_metrics.count("twitter_accounts", num_accounts)
+        logging.debug(f"Twitter Agent - Account Search Complete - Total Accounts: {num_accounts} - Pages Used: {page} - Next Page Budget: {next_budget}")
+
+    def find_accounts_by_keyword(self, keyword):
+        return [account for page_accounts in self.stream_accounts_by_keyword(keyword) for account in page_accounts]
 
 def main():
     pass
@@ -0,0 +1,221 @@
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from .queries import create_keyword_leases_table_stmt, enqueue_keyword_lease_stmt, lease_keywords_stmt, renew_keyword_leases_stmt, complete_keyword_lease_stmt, release_keyword_lease_stmt, delete_old_keyword_leases_stmt, read_unfinished_keyword_lease_round_stmt
+
+
+#Keyword leases in the shared database, every instance pointed at the same database draws from the same rounds
+#Each call borrows its own pooled connection, the heartbeat runs on a separate thread
+class SqlServerKeywordQueue:
+
+    def __init__(self, connection_pool, connection_timeout=30):
+        self.connection_pool = connection_pool
+        self.connection_timeout = connection_timeout
+        with self.connection() as cnxn:
+            cnxn.cursor().execute(create_keyword_leases_table_stmt)
+            cnxn.commit()
+
+    #The monitor holds one of the pool's connections for the whole run, so a small pool can run dry
+    @contextmanager
+    def connection(self):
+        with self.connection_pool.connection(timeout=self.connection_timeout) as cnxn:
+            if cnxn is None:
+                raise Exception(f"Failed to Access Keyword Leases - No Database Connection Available Within {self.connection_timeout} Seconds")
+            yield cnxn
+
+    #None when every round since oldest_round_id is done
+    def unfinished_round(self, oldest_round_id):
+        with self.connection() as cnxn:
+            return cnxn.cursor().execute(read_unfinished_keyword_lease_round_stmt, oldest_round_id).fetchone()[0]
+
+    def enqueue(self, round_id, platform, keyword_ids):
+        if not keyword_ids:
+            return
+        with self.connection() as cnxn:
+            cursor = cnxn.cursor()
+            cursor.execute(delete_old_keyword_leases_stmt, round_id - 1)
+            cursor.executemany(enqueue_keyword_lease_stmt, [(round_id, platform, keyword_id, round_id, platform, keyword_id) for keyword_id in keyword_ids])
+            cnxn.commit()
+
+    def lease(self, round_id, platform, worker_id, limit, lease_seconds):
+        with self.connection() as cnxn:
+            rows = cnxn.cursor().execute(lease_keywords_stmt, limit, worker_id, lease_seconds, round_id, platform).fetchall()
+            cnxn.commit()
+        return [row[0] for row in rows]
+
+    def renew(self, round_id, worker_id, lease_seconds):
+        with self.connection() as cnxn:
+            cursor = cnxn.cursor().execute(renew_keyword_leases_stmt, lease_seconds, round_id, worker_id)
+            cnxn.commit()
+            return cursor.rowcount
+
+    def complete(self, round_id, platform, keyword_id):
+        with self.connection() as cnxn:
+            cnxn.cursor().execute(complete_keyword_lease_stmt, round_id, platform, keyword_id)
+            cnxn.commit()
+
+    def release(self, round_id, platform, keyword_ids, worker_id):
+        if not keyword_ids:
+            return
+        with self.connection() as cnxn:
+            cnxn.cursor().executemany(release_keyword_lease_stmt, [(round_id, platform, keyword_id, worker_id) for keyword_id in keyword_ids])
+            cnxn.commit()
+
+
+#Same leasing rules in a local SQLite file, for running several workers on one machine or trying the scan without the shared table
+class SqliteKeywordQueue:
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("KEYWORD_QUEUE_PATH") or os.path.join(tempfile.gettempdir(), "spoofsniper_keyword_queue.db")
+        self.lock = threading.Lock()
+        #Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE so a lease can't race another process
+        self.cnxn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.cnxn.execute("CREATE TABLE IF NOT EXISTS keyword_leases (round_id INTEGER NOT NULL, platform TEXT NOT NULL, keyword_id INTEGER NOT NULL, leased_by TEXT, lease_expires_at REAL, completed_at REAL, PRIMARY KEY (round_id, platform, keyword_id)) WITHOUT ROWID")
+
+    def unfinished_round(self, oldest_round_id):
+        with self.lock:
+            return self.cnxn.execute("SELECT MAX(round_id) FROM keyword_leases WHERE round_id >= ? AND completed_at IS NULL", (oldest_round_id,)).fetchone()[0]
+
+    def enqueue(self, round_id, platform, keyword_ids):
+        with self.lock:
+            self.cnxn.execute("BEGIN IMMEDIATE")
+            self.cnxn.execute("DELETE FROM keyword_leases WHERE round_id < ?", (round_id - 1,))
+            self.cnxn.executemany("INSERT OR IGNORE INTO keyword_leases (round_id, platform, keyword_id) VALUES (?, ?, ?)", [(round_id, platform, keyword_id) for keyword_id in keyword_ids])
+            self.cnxn.execute("COMMIT")
+
+    def lease(self, round_id, platform, worker_id, limit, lease_seconds):
+        now = time.time()
+        with self.lock:
+            self.cnxn.execute("BEGIN IMMEDIATE")
+            keyword_ids = [row[0] for row in self.cnxn.execute(
+                "SELECT keyword_id FROM keyword_leases WHERE round_id=? AND platform=? AND completed_at IS NULL AND (leased_by IS NULL OR lease_expires_at < ?) ORDER BY keyword_id LIMIT ?",
+                (round_id, platform, now, limit))]
+            self.cnxn.executemany("UPDATE keyword_leases SET leased_by=?, lease_expires_at=? WHERE round_id=? AND platform=? AND keyword_id=?",
+                [(worker_id, now + lease_seconds, round_id, platform, keyword_id) for keyword_id in keyword_ids])
+            self.cnxn.execute("COMMIT")
+        return keyword_ids
+
+    def renew(self, round_id, worker_id, lease_seconds):
+        with self.lock:
+            return self.cnxn.execute("UPDATE keyword_leases SET lease_expires_at=? WHERE round_id=? AND leased_by=? AND completed_at IS NULL", (time.time() + lease_seconds, round_id, worker_id)).rowcount
+
+    def complete(self, round_id, platform, keyword_id):
+        with self.lock:
+            self.cnxn.execute("UPDATE keyword_leases SET completed_at=? WHERE round_id=? AND platform=? AND keyword_id=? AND completed_at IS NULL", (time.time(), round_id, platform, keyword_id))
+
+    def release(self, round_id, platform, keyword_ids, worker_id):
+        with self.lock:
+            self.cnxn.executemany("UPDATE keyword_leases SET leased_by=NULL, lease_expires_at=NULL WHERE round_id=? AND platform=? AND keyword_id=? AND leased_by=? AND completed_at IS NULL",
+                [(round_id, platform, keyword_id, worker_id) for keyword_id in keyword_ids])
+
+    def close(self):
+        with self.lock:
+            self.cnxn.close()
+
+
+#One worker's view of a scan round: leases keywords a few at a time, keeps the leases alive while they're searched and marks them done
+#Every worker firing within the same round_seconds window shares the round, so together they search each keyword once
+#A round left unfinished (time budget, crash) is carried forward and finished before a new one starts, like a resumed ScanCheckpoint
+class KeywordLeases:
+
+    def __init__(self, work_queue, worker_id=None, lease_seconds=None, batch_size=None, round_seconds=None, max_age_hours=None):
+        self.work_queue = work_queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds or int(os.getenv("KEYWORD_LEASE_SECONDS", 600))
+        self.batch_size = batch_size or int(os.getenv("KEYWORD_LEASE_BATCH_SIZE", 1))
+        round_seconds = round_seconds or int(os.getenv("KEYWORD_QUEUE_ROUND_SECONDS", 86400))
+        if max_age_hours is None:
+            max_age_hours = float(os.getenv("SCAN_CHECKPOINT_MAX_AGE_HOURS", 48))
+        current_round_id = int(time.time() // round_seconds)
+        unfinished_round_id = work_queue.unfinished_round(current_round_id - int(max_age_hours * 3600 // round_seconds))
+        self.resumed = unfinished_round_id is not None and unfinished_round_id != current_round_id
+        self.round_id = unfinished_round_id if unfinished_round_id is not None else current_round_id
+        self.held = {}
+        self.held_lock = threading.Lock()
+        self.num_leased = 0
+        self.num_completed = 0
+        self.closed = threading.Event()
+        self.heartbeat = threading.Thread(target=self._renew_periodically, name="KeywordLeaseHeartbeat", daemon=True)
+        self.heartbeat.start()
+
+    def _renew_periodically(self):
+        while not self.closed.wait(self.lease_seconds / 3):
+            with self.held_lock:
+                if not self.held:
+                    continue
+            try:
+                self.work_queue.renew(self.round_id, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logging.warning(f"Work Queue - Keyword Leases - Heartbeat Failed - Worker: {self.worker_id} - Msg: {e.args}")
+
+    #Yields keywords as they're leased, stops once every keyword in the round is completed or leased by someone else
+    def keywords(self, platform, keywords):
+        keywords_by_id = {keyword.keyword_id: keyword for keyword in keywords}
+        self.work_queue.enqueue(self.round_id, platform, list(keywords_by_id))
+        while not self.closed.is_set():
+            keyword_ids = self.work_queue.lease(self.round_id, platform, self.worker_id, self.batch_size, self.lease_seconds)
+            if not keyword_ids:
+                return
+            self.num_leased += len(keyword_ids)
+            for keyword_id in keyword_ids:
+                keyword = keywords_by_id.get(keyword_id)
+                if keyword is None:
+                    self.skip(platform, keyword_id)
+                    continue
+                with self.held_lock:
+                    self.held[(platform, keyword_id)] = keyword
+                yield keyword
+
+    #Deleted since the round was enqueued, or only in another instance's newer keyword list, either way it's marked done so the round can finish
+    def skip(self, platform, keyword_id):
+        try:
+            self.work_queue.complete(self.round_id, platform, keyword_id)
+        except Exception as e:
+            logging.warning(f"Work Queue - Keyword Leases - Skip Unknown Keyword Failed - Worker: {self.worker_id} - Keyword ID: {keyword_id} - Msg: {e.args}")
+            #Held until close so it isn't leased straight back
+            with self.held_lock:
+                self.held[(platform, keyword_id)] = None
+
+    #Runs in the pipeline's database stage, a failure there would drop every remaining write, so the keyword stays held and goes back to the queue instead
+    def complete(self, platform, keyword):
+        try:
+            self.work_queue.complete(self.round_id, platform, keyword.keyword_id)
+        except Exception as e:
+            logging.warning(f"Work Queue - Keyword Leases - Complete Failed, Keyword Will be Searched Again - Worker: {self.worker_id} - Keyword ID: {keyword.keyword_id} - Msg: {e.args}")
+            return
+        with self.held_lock:
+            self.held.pop((platform, keyword.keyword_id), None)
+        self.num_completed += 1
+
+    #Stops the heartbeat and hands anything leased but not completed back to the queue
+    def close(self):
+        self.closed.set()
+        self.heartbeat.join()
+        with self.held_lock:
+            held = list(self.held)
+            self.held = {}
+        for platform in {platform for platform, _ in held}:
+            try:
+                self.work_queue.release(self.round_id, platform, [keyword_id for held_platform, keyword_id in held if held_platform == platform], self.worker_id)
+            except Exception as e:
+                logging.warning(f"Work Queue - Keyword Leases - Release Failed, Leases Will Expire - Worker: {self.worker_id} - Msg: {e.args}")
+        logging.info(f"Work Queue - Keyword Leases - Closed - Worker: {self.worker_id} - Round: {self.round_id} - Leased: {self.num_leased} - Completed: {self.num_completed} - Released: {len(held)}")
+
+
+#None unless KEYWORD_QUEUE names a backend, the SQL Server queue shares the monitor's connection pool
+def create_work_queue(name=None, connection_pool=None):
+    name = (name or os.getenv("KEYWORD_QUEUE", "")).lower()
+    if not name:
+        return None
+    if name == "sql":
+        return SqlServerKeywordQueue(connection_pool)
+    if name == "sqlite":
+        return SqliteKeywordQueue()
+    logging.warning(f"Work Queue - Create Work Queue - Unknown Queue, Keyword Sharding Disabled - Queue: {name}")
+    return None